@@ -0,0 +1,87 @@
+"""
+新闻条目模型基准测试：对比原__dict__实现与__slots__实现的单条目内存占用及序列化耗时
+
+    PYTHONPATH=. python3 hack/bench_item.py
+"""
+
+import json
+import pickle
+import timeit
+import tracemalloc
+
+from rtnews.crawl.news_item import SinaRollNewsItem
+
+N = 10000
+
+class LegacySinaRollNewsItem(object):
+    """
+    原SinaRollNewsItem实现（属性存储在__dict__中，to_dict遍历__dict__）
+    """
+
+    def __init__(self, oid):
+        self._oid = oid
+
+    def to_dict(self):
+        d = {}
+        for k, v in self.__dict__.items():
+            d[k[1:]] = ','.join(v) if type(v) == list else v
+        return d
+
+for _name in ('url', 'lids', 'title', 'timestamp', 'keywords', 'summary', 'body'):
+    def _getter(self, _attr='_' + _name):
+        return getattr(self, _attr)
+    def _setter(self, value, _attr='_' + _name):
+        setattr(self, _attr, value)
+    setattr(LegacySinaRollNewsItem, _name, property(_getter, _setter))
+LegacySinaRollNewsItem.oid = property(lambda self: self._oid)
+
+def _fill(item, i):
+    item.url = f'https://finance.sina.com.cn/stock/2019-12-20/doc-iihnzahi{i:07d}.shtml'
+    item.lids = ['100', '108', '109']
+    item.title = '央行：继续实施稳健的货币政策 保持流动性合理充裕'
+    item.timestamp = str(1576800000 + i)
+    item.keywords = ['央行', '货币政策', '流动性']
+    item.summary = '中国人民银行货币政策委员会召开例会。' * 4
+    item.body = '会议认为，今年以来人民银行按照党中央、国务院决策部署。\n' * 40
+    return item
+
+def _make_items(cls):
+    return [_fill(cls(f'comos:ihnzahi{i:07d}'), i) for i in range(N)]
+
+def _item_memory(cls):
+    # 字段值在两种实现中共享，只统计条目对象自身（及__dict__）的内存
+    template = _fill(SinaRollNewsItem('comos:ihnzahi0000000'), 0)
+    oids = [f'comos:ihnzahi{i:07d}' for i in range(N)]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    items = [cls(oid) for oid in oids]
+    for item in items:
+        for name in ('url', 'lids', 'title', 'timestamp', 'keywords', 'summary', 'body'):
+            setattr(item, name, getattr(template, name))
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del items
+    return (after - before) / N
+
+def _bench(label, stmt, repeat=3):
+    secs = min(timeit.repeat(stmt, number=1, repeat=repeat))
+    print(f'{label:<40}{secs / N * 1e6:>10.2f} us/item')
+
+if __name__ == '__main__':
+    legacy_mem = _item_memory(LegacySinaRollNewsItem)
+    slots_mem = _item_memory(SinaRollNewsItem)
+    print(f'{"memory, legacy (__dict__)":<40}{legacy_mem:>10.0f} B/item')
+    print(f'{"memory, __slots__":<40}{slots_mem:>10.0f} B/item')
+
+    legacy = _make_items(LegacySinaRollNewsItem)
+    slots = _make_items(SinaRollNewsItem)
+    _bench('to_dict, legacy', lambda: [item.to_dict() for item in legacy])
+    _bench('to_dict, __slots__', lambda: [item.to_dict() for item in slots])
+    _bench('pickle, legacy', lambda: [pickle.dumps(item) for item in legacy])
+    _bench('pickle, __slots__', lambda: [pickle.dumps(item) for item in slots])
+    _bench('json(to_dict), legacy', lambda: [json.dumps(item.to_dict()) for item in legacy])
+    _bench('msgpack pack, __slots__', lambda: [item.pack() for item in slots])
+    packed = [item.pack() for item in slots]
+    _bench('msgpack unpack, __slots__', lambda: [SinaRollNewsItem.unpack(b) for b in packed])
+    print(f'{"pickle size, legacy":<40}{len(pickle.dumps(legacy[0])):>10d} B')
+    print(f'{"msgpack size, __slots__":<40}{len(packed[0]):>10d} B')
@@ -0,0 +1,99 @@
+"""
+统一入口：python -m rtnews {crawl,feed,run,archive,coordinator,worker}
+
+所有阶段共用一个事件循环和一个redis连接池。各阶段依赖的模块（pandas、lxml、
+aiohttp、textrank4zh等）只在该阶段实际运行时才导入，启动及各阶段导入耗时
+记录在日志中。
+"""
+
+import time
+_START = time.perf_counter()
+
+import argparse
+import asyncio
+import importlib
+import os
+
+from rtnews import cons as ct
+
+logger = ct.get_logger('rtnews', ct.LOG_LEVEL, ct.MAIN_LOG_FILE)
+
+def _import(name):
+    """
+    导入阶段模块并记录导入耗时
+    """
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    logger.info(f'Imported {name} in {time.perf_counter() - start:.3f}s')
+    return module
+
+async def _crawl(redis, args):
+    ac = _import('rtnews.crawl.async_crawl')
+    await ac.run_task(redis)
+
+async def _feed(redis, args):
+    ne = _import('rtnews.feed.async_newsevent')
+    await ne.feeds(redis)
+
+async def _run(redis, args):
+    if args.archive:
+        try:
+            await _archive(redis, args)
+        except Exception as e:
+            # 归档失败不影响本轮采集
+            logger.error(f'archive failed: {repr(e)}')
+    await _crawl(redis, args)
+    await _feed(redis, args)
+
+async def _archive(redis, args):
+    na = _import('rtnews.archive.news_archive')
+    await na.archive(redis)
+
+async def _coordinator(redis, args):
+    dc = _import('rtnews.crawl.dist_crawl')
+    await dc.run_coordinator(redis)
+
+async def _worker(redis, args):
+    dc = _import('rtnews.crawl.dist_crawl')
+    await dc.run_worker(redis, concurrency=args.concurrency, max_idle_secs=args.max_idle)
+
+async def _main(args):
+    aioredis = _import('aioredis')
+    logger.info(f'Command {args.command} ready after {time.perf_counter() - _START:.3f}s')
+    logger.info(f'Creating redis pool, uri={args.redis_uri}...')
+    redis = await aioredis.create_redis_pool(args.redis_uri, encoding='utf-8')
+    try:
+        start = time.perf_counter()
+        await args.func(redis, args)
+        logger.info(f'Command {args.command} finished in {time.perf_counter() - start:.3f}s')
+    finally:
+        logger.info('Closing redis...')
+        redis.close()
+        await redis.wait_closed()
+
+def _parse_args(argv=None):
+    # 各子命令共用的参数
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--redis-uri', default=os.environ.get(ct.REDIS_URI_ENV, ct.REDIS_URI),
+                        help=f'redis地址，默认取环境变量{ct.REDIS_URI_ENV}，未设置时为{ct.REDIS_URI}')
+
+    parser = argparse.ArgumentParser(prog='python -m rtnews', description='实时新闻采集订阅')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('crawl', parents=[common], help='采集新闻').set_defaults(func=_crawl)
+    subparsers.add_parser('feed', parents=[common], help='生成订阅文件').set_defaults(func=_feed)
+    run = subparsers.add_parser('run', parents=[common], help='采集新闻后生成订阅文件')
+    run.add_argument('--archive', action='store_true', help='采集前先归档即将过期的新闻')
+    run.set_defaults(func=_run)
+    subparsers.add_parser('archive', parents=[common], help='归档即将过期的新闻').set_defaults(func=_archive)
+    subparsers.add_parser('coordinator', parents=[common], help='协调一轮分布式采集').set_defaults(func=_coordinator)
+    worker = subparsers.add_parser('worker', parents=[common], help='处理分布式采集工作单元')
+    worker.add_argument('--concurrency', type=int, default=ct.WORK_CONCURRENCY,
+                        help='进程内并发处理的工作单元数')
+    worker.add_argument('--max-idle', type=int, default=None,
+                        help='队列持续为空超过该秒数后退出，默认一直运行')
+    worker.set_defaults(func=_worker)
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    asyncio.run(_main(_parse_args()))
@@ -0,0 +1,19 @@
+import os
+from rtnews import cons as ct
+
+# 归档文件根目录，按日期分区：date=YYYY-MM-DD/part-xxx.arrow
+ARCHIVE_DIR = os.path.join(ct.DAT_DIR, 'archive')
+PARTITION_DIR = 'date={date}'
+PARTITION_DATE_FMT = '%Y-%m-%d'
+
+# 每次归档写入分区下的一个part文件，分区不再有新数据后合并为一个COMPACT_FILE
+PART_FILE = 'part-{ts}-{uid}.arrow'
+COMPACT_FILE = 'data.arrow'
+
+# 提前归档时长：在该时长内即将过期的新闻会被归档，需大于采集周期
+ARCHIVE_AHEAD_SECS = 2 * ct.CRAWL_CYCLE_SECS
+
+# 归档文件中每个record batch的最大行数，读取时按batch的时间范围跳过
+ARCHIVE_BATCH_ROWS = 256
+
+ARCHIVE_COLS = ['oid', 'lids', 'title', 'timestamp', 'keywords', 'summary', 'body']
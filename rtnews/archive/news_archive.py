@@ -0,0 +1,295 @@
+import aioredis
+import pyarrow as pa
+import numpy as np
+from datetime import datetime
+import asyncio
+import os
+import uuid
+
+from rtnews import cons as ct
+from rtnews.archive import archive_vars as av
+
+logger = ct.get_logger('archive', ct.LOG_LEVEL, ct.ARCHIVE_LOG_FILE)
+
+_SCHEMA = pa.schema([
+    ('oid', pa.string()),
+    ('lids', pa.list_(pa.string())),
+    ('title', pa.string()),
+    ('timestamp', pa.int64()),
+    ('keywords', pa.list_(pa.string())),
+    ('summary', pa.string()),
+    ('body', pa.string()),
+])
+
+async def archive_news(redis):
+    """
+    将即将过期的新闻归档到本地按日期分区的arrow文件中
+
+    时间戳在(当前时间-NEWS_EXPIRE_SECS, 当前时间-NEWS_EXPIRE_SECS+ARCHIVE_AHEAD_SECS]
+    之间且尚未归档的新闻被写入其时间戳所在日期的分区，已归档的新闻key记录在
+    archived中，随新闻过期一并清除。之后不会再有新数据的分区被合并为一个文件。
+
+    Parameters
+    --------
+        redis: aioredis.RedisPool
+
+    Return
+    --------
+        int, 本次归档的新闻条数
+    """
+    ts_expire = int(datetime.now().timestamp()) - ct.NEWS_EXPIRE_SECS
+    ts_archive = ts_expire + av.ARCHIVE_AHEAD_SECS
+
+    news_keys = set()
+    for lid in ct.GLOBAL_CHANNELS:
+        lid_key = ct.KEY_LID.format(lid=lid)
+        news_keys.update(await redis.zrangebyscore(
+            lid_key, min=ts_expire, max=ts_archive, exclude=redis.ZSET_EXCLUDE_MIN))
+    news_keys.difference_update(await redis.zrangebyscore(
+        ct.KEY_ARCHIVED, min=ts_expire, max=ts_archive, exclude=redis.ZSET_EXCLUDE_MIN))
+    news_keys = sorted(news_keys)
+    logger.info(f'Found {len(news_keys)} news to archive, timeline=({ts_expire}, {ts_archive}]')
+
+    pipe = redis.pipeline()
+    futs = [pipe.hgetall(news_key) for news_key in news_keys]
+    await pipe.execute()
+
+    partitions = {}
+    archived = []
+    for news_key, fut in zip(news_keys, futs):
+        news = fut.result()
+        if not news:
+            continue
+        timestamp = int(news['timestamp'])
+        date = datetime.fromtimestamp(timestamp).strftime(av.PARTITION_DATE_FMT)
+        partitions.setdefault(date, []).append(news)
+        archived.extend([timestamp, news_key])
+
+    for date, rows in partitions.items():
+        _write_partition(date, rows)
+
+    # 写入文件后、记录archived前中断时，下次会重复归档，合并及读取时按oid去重
+    if archived:
+        await redis.zadd(ct.KEY_ARCHIVED, *archived)
+    await redis.zremrangebyscore(ct.KEY_ARCHIVED, max=ts_expire)
+    logger.info(f'Archived {len(archived) // 2} news to {len(partitions)} partitions')
+
+    compact_partitions(datetime.fromtimestamp(ts_archive).strftime(av.PARTITION_DATE_FMT))
+    return len(archived) // 2
+
+def _write_partition(date, rows):
+    """
+    将新闻按时间戳排序后写入日期分区下的一个新文件
+
+    Parameters
+    --------
+        date: str, 分区日期
+        rows: list(dict), 从redis读取的新闻hash
+    """
+    rows = sorted(rows, key=lambda news: int(news['timestamp']))
+    columns = {
+        'oid': [news['oid'] for news in rows],
+        'lids': [[lid for lid in news['lids'].split(',') if lid] for news in rows],
+        'title': [news['title'] for news in rows],
+        'timestamp': [int(news['timestamp']) for news in rows],
+        'keywords': [[kw for kw in news['keywords'].split(',') if kw] for news in rows],
+        'summary': [news['summary'] for news in rows],
+        'body': [news['body'] for news in rows],
+    }
+    table = pa.Table.from_pydict(columns, schema=_SCHEMA)
+
+    part_dir = os.path.join(av.ARCHIVE_DIR, av.PARTITION_DIR.format(date=date))
+    os.makedirs(part_dir, exist_ok=True)
+    part_file = os.path.join(part_dir, av.PART_FILE.format(ts=int(datetime.now().timestamp()), uid=uuid.uuid4().hex[:8]))
+    logger.info(f'Writing archive file: {part_file}, news count: {len(rows)}')
+    _write_table(part_file, table)
+
+def _write_table(path, table):
+    """
+    以record batch为单位写入arrow文件，先写临时文件再替换，避免读取到不完整的文件
+    """
+    tmp_file = path + '.tmp'
+    with pa.OSFile(tmp_file, 'wb') as sink:
+        with pa.ipc.new_file(sink, _SCHEMA) as writer:
+            for batch in table.to_batches(max_chunksize=av.ARCHIVE_BATCH_ROWS):
+                writer.write_batch(batch)
+    os.replace(tmp_file, path)
+
+def _dedupe(table):
+    """
+    按时间戳排序，并按oid去重
+    """
+    if table.num_rows == 0:
+        return table
+    timestamps = table.column('timestamp')
+    order = np.argsort(np.concatenate([chunk.to_numpy() for chunk in timestamps.chunks]), kind='stable')
+    return _dedupe_oid(table.take(pa.array(order)))
+
+def _dedupe_oid(table):
+    """
+    按oid去重，保留每个oid首次出现的行
+
+    只使用pyarrow 2.0中已有的接口：ChunkedArray.to_numpy()在2.0中不支持zero_copy_only参数
+    """
+    first = {}
+    for i, oid in enumerate(table.column('oid').to_pylist()):
+        first.setdefault(oid, i)
+    if len(first) == table.num_rows:
+        return table
+    return table.take(pa.array(list(first.values()), type=pa.int64()))
+
+def compact_partitions(before_date):
+    """
+    将日期早于before_date的分区中的所有文件合并为一个按时间戳排序、按oid去重的COMPACT_FILE
+
+    Parameters
+    --------
+        before_date: str, 分区日期，该日期之前的分区不会再有新数据
+    """
+    for date, part_dir in _partitions():
+        if date >= before_date:
+            continue
+        files = _arrow_files(part_dir)
+        part_files = [f for f in files if os.path.basename(f) != av.COMPACT_FILE]
+        if not part_files:
+            continue
+        tables = [pa.ipc.open_file(pa.memory_map(f, 'r')).read_all() for f in files]
+        table = _dedupe(pa.concat_tables(tables))
+        compact_file = os.path.join(part_dir, av.COMPACT_FILE)
+        logger.info(f'Compacting {len(files)} archive files to {compact_file}, news count: {table.num_rows}')
+        _write_table(compact_file, table)
+        for f in part_files:
+            os.remove(f)
+
+def _partitions():
+    """
+    列出所有日期分区，忽略归档目录下的其它文件
+
+    Return
+    --------
+        list((str, str)), (分区日期, 分区目录)
+    """
+    if not os.path.isdir(av.ARCHIVE_DIR):
+        return []
+    prefix = av.PARTITION_DIR.format(date='')
+    partitions = []
+    for part_name in sorted(os.listdir(av.ARCHIVE_DIR)):
+        part_dir = os.path.join(av.ARCHIVE_DIR, part_name)
+        if part_name.startswith(prefix) and os.path.isdir(part_dir):
+            partitions.append((part_name[len(prefix):], part_dir))
+    return partitions
+
+def _arrow_files(part_dir):
+    return [os.path.join(part_dir, f) for f in sorted(os.listdir(part_dir))
+            if f.endswith('.arrow') and os.path.isfile(os.path.join(part_dir, f))]
+
+def _partition_files(start, end):
+    """
+    列出与时间范围[start, end)有交集的日期分区下的所有归档文件
+    """
+    start_date = None if start is None else datetime.fromtimestamp(start).strftime(av.PARTITION_DATE_FMT)
+    end_date = None if end is None else datetime.fromtimestamp(end).strftime(av.PARTITION_DATE_FMT)
+    files = []
+    for date, part_dir in _partitions():
+        if (start_date and date < start_date) or (end_date and date > end_date):
+            continue
+        files.extend(_arrow_files(part_dir))
+    return files
+
+def read_archive(channel=None, start=None, end=None, columns=None):
+    """
+    查询归档的新闻
+
+    归档文件以内存映射方式打开，先按日期分区、再按record batch的时间范围跳过
+    无关数据，只有被选中的列（及用于去重的oid列）会从磁盘读入。结果按oid去重。
+
+    Parameters
+    -------
+        channel: str, 新闻所在频道(id或名称)，默认None不过滤
+        start: int, 时间戳，获取不小于该时间戳的新闻，默认None不限
+        end: int, 时间戳，获取小于该时间戳的新闻，默认None不限
+        columns: list(str), 返回的列，取值见ARCHIVE_COLS，默认None全部返回
+
+    Result
+    -------
+        pyarrow.Table, 可通过to_pandas()转换为pandas.DataFrame
+    """
+    lid = None
+    if channel is not None:
+        if channel in ct.GLOBAL_CHANNELS:
+            lid = channel
+        else:
+            reversed_dic = {v: k for k, v in ct.GLOBAL_CHANNELS.items()}
+            if channel not in reversed_dic:
+                raise ValueError(f'Parameter "channel": value "{channel}" undefined.')
+            lid = reversed_dic[channel]
+    columns = av.ARCHIVE_COLS if columns is None else columns
+    for col in columns:
+        if col not in av.ARCHIVE_COLS:
+            raise ValueError(f'Parameter "columns": value "{col}" undefined.')
+    # 始终读取oid列用于去重
+    read_columns = columns if 'oid' in columns else ['oid'] + list(columns)
+    schema = pa.schema([_SCHEMA.field(col) for col in read_columns])
+
+    batches = []
+    for part_file in _partition_files(start, end):
+        reader = pa.ipc.open_file(pa.memory_map(part_file, 'r'))
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            if batch.num_rows == 0:
+                continue
+            timestamps = batch.column(_SCHEMA.get_field_index('timestamp'))
+            # batch内按时间戳有序，根据首尾时间戳跳过整个batch
+            if start is not None and timestamps[-1].as_py() < start:
+                continue
+            if end is not None and timestamps[0].as_py() >= end:
+                continue
+            mask = np.ones(batch.num_rows, dtype=bool)
+            if start is not None or end is not None:
+                ts = timestamps.to_numpy()
+                if start is not None:
+                    mask &= ts >= start
+                if end is not None:
+                    mask &= ts < end
+            if lid is not None:
+                mask &= _lid_mask(batch.column(_SCHEMA.get_field_index('lids')), lid)
+            selected = pa.RecordBatch.from_arrays(
+                [batch.column(_SCHEMA.get_field_index(col)) for col in read_columns], schema=schema)
+            batches.append(selected if mask.all() else selected.filter(pa.array(mask)))
+    table = _dedupe_oid(pa.Table.from_batches(batches, schema=schema))
+    if read_columns is columns:
+        return table
+    return pa.Table.from_arrays([table.column(col) for col in columns],
+                                schema=pa.schema([_SCHEMA.field(col) for col in columns]))
+
+def _lid_mask(lids, lid):
+    """
+    lids列中包含频道lid的行
+    """
+    mask = np.zeros(len(lids), dtype=bool)
+    offsets = lids.offsets.to_numpy()
+    parents = np.repeat(np.arange(len(lids)), np.diff(offsets))
+    flat = lids.flatten().to_numpy(zero_copy_only=False)
+    mask[parents[flat == lid]] = True
+    return mask
+
+async def archive(redis=None):
+    """
+    运行一次归档任务
+
+    Parameters
+    --------
+        redis: aioredis.RedisPool，默认None时自行创建并在结束时关闭
+    """
+    own_redis = redis is None
+    if own_redis:
+        logger.info('Creating redis pool...')
+        redis = await aioredis.create_redis_pool(ct.REDIS_URI, encoding='utf-8')
+    await archive_news(redis)
+    if own_redis:
+        logger.info('Closing redis...')
+        redis.close()
+        await redis.wait_closed()
+
+if __name__ == '__main__':
+    asyncio.run(archive())
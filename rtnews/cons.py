@@ -37,17 +37,47 @@ MAX_SUMMARY_TOTAL_WORDS_NUM = 150
 
 # Redis 相关配置
 REDIS_URI = 'redis://127.0.0.1:6379'
+# 可通过该环境变量或python -m rtnews的--redis-uri参数覆盖REDIS_URI，如其它主机上的worker
+REDIS_URI_ENV = 'RTNEWS_REDIS_URI'
 KEY_CHANNELS = 'channels'
 KEY_LID = 'lid-{lid}'
 KEY_NEWS = 'news-{oid}'
+KEY_WORK_QUEUE = 'work-queue'
+KEY_WORK_LEASES = 'work-leases'
+KEY_WORK_RESULTS = 'work-results-{run}'
+KEY_WORK_DEAD = 'work-dead'
+KEY_WORK_ATTEMPTS = 'work-attempts'
+KEY_ARCHIVED = 'archived'
+KEY_SUMMARY = 'summary-{digest}'
+# 发布/订阅频道，消息为需要从读缓存中失效的新闻key
+CHANNEL_NEWS_INVALIDATE = 'news-invalidate'
+
+# 分布式采集：工作单元租约时长，超时未确认的工作单元将重新入队
+WORK_LEASE_SECS = 5 * 60
+
+# 分布式采集：工作单元最大尝试次数，超过后移入work-dead
+WORK_MAX_ATTEMPTS = 3
+
+# 分布式采集：每个worker进程内并发处理的工作单元数
+WORK_CONCURRENCY = 4
+
+# 分布式采集：队列为空时的轮询间隔
+WORK_POLL_SECS = 1
 
 # 新闻过期时长
 NEWS_EXPIRE_SECS = 2*24*60*60
 
+# 新闻摘要缓存：进程内LRU最大条数，redis中缓存的生存时长
+SUMMARY_CACHE_SIZE = 4096
+SUMMARY_CACHE_TTL_SECS = NEWS_EXPIRE_SECS
+
 # 采集周期 30分钟
 CRAWL_CYCLE_SECS = 30 * 60
 #CRAWL_CYCLE_SECS = 3*24*60*60
 
+# 分布式采集：每轮的work-results-{run}的生存时长，协调者异常退出时由redis清理
+WORK_RESULTS_EXPIRE_SECS = 2 * CRAWL_CYCLE_SECS
+
 # dir and log file
 import sys
 import os
@@ -61,15 +91,25 @@ DAT_DIR = os.path.join(WORK_DIR, 'dat')
 # 注释LOG_FILE即可打印到终端
 CRAWL_LOG_FILE = os.path.join(DAT_DIR, 'crawl.log')
 FEED_LOG_FILE = os.path.join(DAT_DIR, 'feed.log')
+DIST_CRAWL_LOG_FILE = os.path.join(DAT_DIR, 'dist_crawl.log')
+ARCHIVE_LOG_FILE = os.path.join(DAT_DIR, 'archive.log')
+MAIN_LOG_FILE = os.path.join(DAT_DIR, 'rtnews.log')
 #print(LOG_FILE)
-if not os.path.exists(DAT_DIR):
-    os.mkdir(DAT_DIR)
+
+class _RotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    首次写日志时才创建日志目录和文件，导入模块及python -m rtnews --help不会产生dat目录
+    """
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+        return super()._open()
 
 def get_logger(log_name, log_level, log_file=None):
     logger = logging.getLogger(log_name)
     logger.setLevel(log_level)
     if log_file:
-        fh = logging.handlers.RotatingFileHandler(log_file, mode='a', maxBytes=1024*1024*10, backupCount=2, encoding='utf-8', delay=False)
+        fh = _RotatingFileHandler(log_file, mode='a', maxBytes=1024*1024*10, backupCount=2, encoding='utf-8', delay=True)
     else:
         fh = logging.StreamHandler(sys.stdout)
     datefmt = '%Y-%m-%d %H:%M:%S'
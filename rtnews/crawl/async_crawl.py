@@ -1,4 +1,6 @@
 from rtnews.crawl import crawl_vars as cv
+from rtnews.crawl.news_item import SinaRollNewsItem
+from rtnews.crawl.summary_cache import SummaryCache
 from rtnews import cons as ct
 import asyncio
 import aioredis
@@ -7,132 +9,41 @@ import aiohttp
 import lxml.html
 from lxml import etree
 from io import StringIO
-from textrank4zh import TextRank4Sentence
 import sys
 import re
 
 logger = ct.get_logger('crawl', ct.LOG_LEVEL, ct.CRAWL_LOG_FILE)
 
-class SinaRollNewsItem(object):
-    """
-    新浪滚动新闻条目信息，包含：
-
-        oid: 唯一标识
-        url: str，网址
-        lids: list(str)，所属频道id列表
-        title: str，标题
-        timestamp: str，时间戳
-        keywords: list(str)，关键字列表
-        summary: str，摘要
-        body: str，正文
-    """
-
-    def __init__(self, oid):
-        self._oid = oid
-
-    def __str__(self):
-        if len(self._body) > ct.MAX_SUMMARY_SENTENCES_NUM * ct.MAX_SUMMARY_SENTENCE_WORDS_NUM:
-            half = ct.MAX_SUMMARY_SENTENCES_NUM * ct.MAX_SUMMARY_SENTENCE_WORDS_NUM // 4
-            body = self._body[:half] + '...' + self._body[0-half:]
-        else:
-            body = self._body
-        return (f'SinaRollNewsItem<oid={self._oid}, url={self._url}, '
-                f'lids={self._lids}, title={self._title}, timestamp={self._timestamp}, '
-                f'keywords={self._keywords}, summary={self._summary}, body={body}>')
-
-    def to_dict(self):
-        d = {}
-        for k, v in self.__dict__.items():
-            d[k[1:]] = ','.join(v) if type(v) == list else v
-        return d
-
-    @property
-    def oid(self):
-        return self._oid
-
-    @oid.setter
-    def oid(self, value):
-        self._oid = value
-
-    @property
-    def url(self):
-        return self._url
-
-    @url.setter
-    def url(self, value):
-        self._url = value
-
-    @property
-    def lids(self):
-        return self._lids
-
-    @lids.setter
-    def lids(self, value):
-        self._lids = value
-
-    @property
-    def title(self):
-        return self._title
-
-    @title.setter
-    def title(self, value):
-        self._title = value
-
-    @property
-    def timestamp(self):
-        return self._timestamp
-
-    @timestamp.setter
-    def timestamp(self, value):
-        self._timestamp = value
-
-    @property
-    def keywords(self):
-        return self._keywords
-
-    @keywords.setter
-    def keywords(self, value):
-        self._keywords = value
-
-    @property
-    def summary(self):
-        return self._summary
-
-    @summary.setter
-    def summary(self, value):
-        self._summary = value
-
-    @property
-    def body(self):
-        return self._body
-
-    @body.setter
-    def body(self, value):
-        self._body = value
-
-async def run_task():
+async def run_task(redis=None):
     """
     异步运行新闻采集任务。
 
     每个新闻频道对应一个采集任务，同时创建相同个数的redis持久化任务，
     采集到的新闻条目放入异步队列，redis持久化任务读取队列并持久化到redis中。
+
+    Parameters
+    --------
+        redis: aioredis.RedisPool，默认None时自行创建并在结束时关闭
     """
     logger.info(f'Global channels: {ct.GLOBAL_CHANNELS}')
     logger.info('Creating queue...')
     queue = asyncio.Queue()
 
-    logger.info('Creating redis pool...')
-    redis = await aioredis.create_redis_pool(ct.REDIS_URI, encoding='utf-8')
+    own_redis = redis is None
+    if own_redis:
+        logger.info('Creating redis pool...')
+        redis = await aioredis.create_redis_pool(ct.REDIS_URI, encoding='utf-8')
 
     ts_now = int(datetime.now().timestamp())
     ts_crawl = ts_now - ct.CRAWL_CYCLE_SECS
     ts_expire = ts_now - ct.NEWS_EXPIRE_SECS # 时间戳比该值小的新闻均过期
 
     logger.info('Maintaining redis...')
-    await _maintain(redis, ts_expire)
+    await maintain(redis, ts_expire)
 
     logger.info('Creating crawl tasks...')
-    crawl_tasks = [asyncio.create_task(_crawl(queue, lid, ts_crawl)) for lid in ct.GLOBAL_CHANNELS]
+    summary_cache = SummaryCache(redis)
+    crawl_tasks = [asyncio.create_task(_crawl(queue, summary_cache, lid, ts_crawl)) for lid in ct.GLOBAL_CHANNELS]
     logger.info(f'Created {len(crawl_tasks)} tasks, task=_crawl')
 
     logger.info('Creating save tasks...')
@@ -148,6 +59,7 @@ async def run_task():
 
     logger.info('Joining queue...')
     await queue.join()
+    logger.info(f'Summary cache: {summary_cache}')
 
     logger.info('Cancelling save tasks...')
     [save_task.cancel() for save_task in save_tasks]
@@ -155,9 +67,10 @@ async def run_task():
     #logger.info('Gathering save tasks...')
     #await asyncio.gather(*save_tasks, return_exceptions=True)
 
-    logger.info('Closing redis...')
-    redis.close()
-    await redis.wait_closed()
+    if own_redis:
+        logger.info('Closing redis...')
+        redis.close()
+        await redis.wait_closed()
 
 async def _save(queue, redis):
     """
@@ -170,20 +83,35 @@ async def _save(queue, redis):
     """
     while True:
         news_item = await queue.get()
-        if not news_item.oid:
-            raise ValueError('News item oid empty')
-
-        key = ct.KEY_NEWS.format(oid=news_item.oid)
-        logger.info(f'Save news: key={key}')
-        if not await redis.exists(key):
-            await redis.hmset_dict(key, news_item.to_dict())
-            await redis.expireat(key, int(news_item.timestamp) + ct.NEWS_EXPIRE_SECS)
-            for lid in news_item.lids:
-                await redis.zadd(ct.KEY_LID.format(lid=lid), int(news_item.timestamp), key)
-
+        await save_news_item(redis, news_item)
         queue.task_done()
 
-async def _maintain(redis, ts_expire):
+async def save_news_item(redis, news_item):
+    """
+    将一条新闻条目存取到redis中，已存在的新闻不会被覆盖
+
+    Parameters
+    --------
+        redis: aioredis.RedisPool
+        news_item: SinaRollNewsItem，待存储的新闻条目
+    """
+    if not news_item.oid:
+        raise ValueError('News item oid empty')
+
+    key = ct.KEY_NEWS.format(oid=news_item.oid)
+    expire_at = int(news_item.timestamp) + ct.NEWS_EXPIRE_SECS
+    if expire_at <= int(datetime.now().timestamp()):
+        # 已过期的新闻不写入频道zset，避免产生无效的key
+        logger.warning(f'News already expired, skip it. key={key}')
+        return
+    logger.info(f'Save news: key={key}')
+    if not await redis.exists(key):
+        await redis.hmset_dict(key, news_item.to_dict())
+        await redis.expireat(key, expire_at)
+        for lid in news_item.lids:
+            await redis.zadd(ct.KEY_LID.format(lid=lid), int(news_item.timestamp), key)
+
+async def maintain(redis, ts_expire):
     """
     维护存储的key和value，清除过期内容
 
@@ -203,9 +131,30 @@ async def _maintain(redis, ts_expire):
         if v != None:
             logger.error(f'index: {i}, _maintain_lid_zset task failed: {str(v)}')
 
+# 在redis服务端清理频道zset：删除分数不大于ARGV[1]的key，以及对应新闻hash已不存在的key，
+# 后者通过ARGV[2]频道通知读取方失效缓存
+_SWEEP_LID_ZSET_SCRIPT = """
+local removed = redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+local dead = {}
+for _, member in ipairs(redis.call('ZRANGE', KEYS[1], 0, -1)) do
+    if redis.call('EXISTS', member) == 0 then
+        dead[#dead + 1] = member
+        redis.call('PUBLISH', ARGV[2], member)
+        if #dead == 1000 then
+            removed = removed + redis.call('ZREM', KEYS[1], unpack(dead))
+            dead = {}
+        end
+    end
+end
+if #dead > 0 then
+    removed = removed + redis.call('ZREM', KEYS[1], unpack(dead))
+end
+return removed
+"""
+
 async def _maintain_lid_zset(redis, ts_expire, lid):
     """
-    维护频道内的新闻条目的key集合，清除过期的key
+    维护频道内的新闻条目的key集合，清除过期的key以及新闻hash已不存在的key
 
     Parameters
     --------
@@ -214,16 +163,18 @@ async def _maintain_lid_zset(redis, ts_expire, lid):
         lid: 新闻频道的id
     """
     key = ct.KEY_LID.format(lid=lid)
-    logger.debug(f'Redis: zremrangebyscore, key={key}, min={float("-inf")}, max={ts_expire}')
-    await redis.zremrangebyscore(key, min=float('-inf'), max=ts_expire)
+    logger.debug(f'Redis: eval _SWEEP_LID_ZSET_SCRIPT, key={key}, max={ts_expire}')
+    removed = await redis.eval(_SWEEP_LID_ZSET_SCRIPT, keys=[key], args=[ts_expire, ct.CHANNEL_NEWS_INVALIDATE])
+    logger.info(f'Removed {removed} expired news keys from {key}')
 
-async def _crawl(queue, global_lid, timeline):
+async def _crawl(queue, summary_cache, global_lid, timeline):
     """
     异步方式抓取指定新闻频道在指定时间戳之后的新闻
 
     Parameters
     --------
         queue: asyncio.Queue(SinaRollNewsItem)，存放抓取到的新闻条目
+        summary_cache: SummaryCache，新闻摘要缓存
         global_lid: str，新闻频道类别id
         timeline: int，时间戳，抓取大于该时间戳的新闻
 
@@ -236,18 +187,10 @@ async def _crawl(queue, global_lid, timeline):
         raise KeyError(global_lid)
     logger.info(f'Crawl: channel={ct.GLOBAL_CHANNELS[global_lid]}({global_lid}), '
                  f'timeline={datetime.fromtimestamp(timeline)}({timeline})')
-    pageid = cv.SINA_CHANNELS[global_lid].get('pageid', '153')
-    slid = cv.SINA_CHANNELS[global_lid]['slid']
     page = 1
     while True:
-        url = cv.CRAWL_URL.format(
-            p_type=ct.P_TYPE['https'],
-            domain=ct.DOMAINS['sfeed'],
-            pageid=pageid,
-            channelid=slid,
-            num=ct.PAGE_NUM[1],
-            page=page)
-        next_page = await _crawl_page(queue, global_lid, url, timeline)
+        url = roll_page_url(global_lid, page)
+        next_page = await _crawl_page(queue, summary_cache, global_lid, url, timeline)
         if next_page:
             page = page + 1
         else:
@@ -255,13 +198,43 @@ async def _crawl(queue, global_lid, timeline):
             break
 
 
-async def _crawl_page(queue, global_lid, url, timeline):
+def roll_page_url(global_lid, page):
+    """
+    生成指定新闻频道滚动新闻列表第page页的url
+
+    Parameters
+    --------
+        global_lid: str，新闻频道类别id
+        page: int，页码，从1开始
+
+    Return
+    --------
+        str, 滚动新闻列表的url
+    """
+    return cv.CRAWL_URL.format(
+        p_type=ct.P_TYPE['https'],
+        domain=ct.DOMAINS['sfeed'],
+        pageid=cv.SINA_CHANNELS[global_lid].get('pageid', '153'),
+        channelid=cv.SINA_CHANNELS[global_lid]['slid'],
+        num=ct.PAGE_NUM[1],
+        page=page)
+
+def client_session():
+    """
+    创建请求新浪滚动新闻所用的异步http会话
+    """
+    header = {'referer': cv.REF_URL.format(p_type=ct.P_TYPE['https'], domain=ct.DOMAINS['sn']),
+              'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/78.0.3904.97 Safari/537.36'}
+    return aiohttp.ClientSession(headers=header, connector=aiohttp.TCPConnector(ssl=False))
+
+async def _crawl_page(queue, summary_cache, global_lid, url, timeline):
     """
     异步方式抓取指定url在指定时间戳之后的新闻
 
     Parameters
     --------
         queue: asyncio.Queue(SinaRollNewsItem)，存放抓取到的新闻条目
+        summary_cache: SummaryCache，新闻摘要缓存
         url: str，待请求的url
         global_lid: str，新闻频道类别id
         timeline: int，时间戳，抓取大于该时间戳的新闻
@@ -270,19 +243,34 @@ async def _crawl_page(queue, global_lid, url, timeline):
         bool, 是否继续抓取下一页
     --------
 
+    """
+    async with client_session() as session:
+        json_response = await fetch_roll_page(session, url)
+        if json_response is None:
+            return False
+        return await _parse_news_items(queue, summary_cache, session, global_lid, timeline, json_response)
+
+async def fetch_roll_page(session, url):
+    """
+    请求滚动新闻列表页
+
+    Parameters
+    --------
+        session: aiohttp.ClientSession，异步http会话
+        url: str，待请求的url
+
+    Return
+    --------
+        json, 滚动新闻列表；响应不是json时返回None
     """
     logger.info(f'Crawl page: {url}')
-    header = {'referer': cv.REF_URL.format(p_type=ct.P_TYPE['https'], domain=ct.DOMAINS['sn']),
-              'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/78.0.3904.97 Safari/537.36'}
-    async with aiohttp.ClientSession(headers=header, connector=aiohttp.TCPConnector(ssl=False)) as session:
-        async with session.get(url) as response:
-            try:
-                json_response = await response.json(encoding=response.charset if response.charset else 'utf-8')
-                #logger.debug(f'News json response: {json_response}')
-            except aiohttp.ContentTypeError:
-                logger.warning(
-                    f'Skip this response. Reason: content-type not match, expect: "application/json", get: "{response.content_type}"')
-            return await _parse_news_items(queue, session, global_lid, timeline, json_response)
+    async with session.get(url) as response:
+        try:
+            return await response.json(encoding=response.charset if response.charset else 'utf-8')
+        except aiohttp.ContentTypeError:
+            logger.warning(
+                f'Skip this response. Reason: content-type not match, expect: "application/json", get: "{response.content_type}"')
+            return None
 
 
 def _title_pass(title):
@@ -297,13 +285,14 @@ def _repalce_sensitive(content):
             return content.replace(k, v)
     return content
 
-async def _parse_news_items(queue, session, global_lid, timeline, json_response):
+async def _parse_news_items(queue, summary_cache, session, global_lid, timeline, json_response):
     """
     解析json中的新闻条目列表
 
     Parameters
     --------
         queue: asyncio.Queue(SinaRollNewsItem)，存放抓取到的新闻条目
+        summary_cache: SummaryCache，新闻摘要缓存
         session: aiohttp.ClientSession，异步http会话，用于请求新闻正文
         global_lid: str，新闻频道类别id
         timeline: int，时间戳，抓取大于该时间戳的新闻
@@ -312,6 +301,31 @@ async def _parse_news_items(queue, session, global_lid, timeline, json_response)
     Return
         bool, 是否继续抓取下一页
     """
+    obj_items, next_page = parse_roll_items(timeline, json_response)
+    for obj_item in obj_items:
+        if not await fetch_news_item_body(session, summary_cache, obj_item):
+            continue
+        # append to async queue
+        logger.info(f'Put news item to queue: oid={obj_item.oid}, title={obj_item.title}')
+        logger.debug('News item: %s', obj_item)
+        await queue.put(obj_item)
+    return next_page
+
+def parse_roll_items(timeline, json_response):
+    """
+    解析json中的新闻条目列表，生成尚未包含正文和摘要的新闻条目
+
+    Parameters
+    --------
+        timeline: int，时间戳，抓取大于该时间戳的新闻
+        json_response：json，包含待解析的新闻条目列表
+
+    Return
+    --------
+        list(SinaRollNewsItem), 新闻条目列表
+        bool, 是否继续抓取下一页
+    """
+    obj_items = []
     next_page = True
     try:
         for json_item in json_response['result']['data']:
@@ -336,26 +350,40 @@ async def _parse_news_items(queue, session, global_lid, timeline, json_response)
             obj_item.lids = [cv.SINA_CHANNELS_1[slid]['lid']
                              for slid in lids if slid in cv.SINA_CHANNELS_1]
             obj_item.keywords = json_item['keywords'].split(',')
-            # get news body and summary
-            async with session.get(obj_item.url) as response:
-                text = await response.text(encoding=response.charset if response.charset else 'utf-8')
-                obj_item.body, obj_item.summary = _parse_news_item_body(text)
-            if not obj_item.body.strip() or not obj_item.summary.strip():
-                logger.warning(f'News item body/summary empty, skip it. url: {obj_item.url}')
-                continue
-            obj_item.summary = _repalce_sensitive(obj_item.summary)
-            # append to async queue
-            logger.info(f'Put news item to queue: {obj_item}')
-            await queue.put(obj_item)
+            obj_items.append(obj_item)
     except KeyError as e:
         logger.error(f'news item parse error, exception: key {e} not found')
         next_page = False
-    return next_page
+    return obj_items, next_page
+
+async def fetch_news_item_body(session, summary_cache, obj_item):
+    """
+    请求新闻正文网页，解析正文并生成摘要，正文相同的新闻复用缓存的摘要
+
+    Parameters
+    --------
+        session: aiohttp.ClientSession，异步http会话，用于请求新闻正文
+        summary_cache: SummaryCache，新闻摘要缓存
+        obj_item: SinaRollNewsItem，新闻条目，正文和摘要将写入该条目
+
+    Return
+    --------
+        bool, 正文和摘要是否有效
+    """
+    async with session.get(obj_item.url) as response:
+        text = await response.text(encoding=response.charset if response.charset else 'utf-8')
+        obj_item.body = _parse_news_item_body(text)
+    obj_item.summary = await summary_cache.get_or_summarize(obj_item.body, _summarize) if obj_item.body else ''
+    if not obj_item.body.strip() or not obj_item.summary.strip():
+        logger.warning(f'News item body/summary empty, skip it. url: {obj_item.url}')
+        return False
+    obj_item.summary = _repalce_sensitive(obj_item.summary)
+    return True
 
 
 def _parse_news_item_body(text):
     """
-    解析新闻条目的正文，并根据正文生成摘要
+    解析新闻条目的正文
 
     Parameters:
     ------
@@ -364,7 +392,6 @@ def _parse_news_item_body(text):
     Return:
     ------
         body: str, 新闻正文
-        summary: str, 新闻摘要
 
     """
     html = lxml.html.parse(StringIO(text))
@@ -389,9 +416,26 @@ def _parse_news_item_body(text):
         p_text = re.sub('^\u3000\u3000(新浪.{0,6}|.+[报网])讯[\u3000 ,.。，]?(（记者.+）)?', '\u3000\u3000', p_text)
         
         body = body + p_text + '\n'
-    summary = ''
     logger.debug(f'news body: {body}')
+    return body
+
+def _summarize(body):
+    """
+    使用TextRank从新闻正文中提取摘要
+
+    Parameters:
+    ------
+        body: str, 新闻正文
+
+    Return:
+    ------
+        summary: str, 新闻摘要
+
+    """
+    summary = ''
     if body:
+        # textrank4zh导入时加载jieba词典，耗时较长，仅在需要生成摘要时导入
+        from textrank4zh import TextRank4Sentence
         tr4s = TextRank4Sentence()
         tr4s.analyze(text=body, lower=True, source = 'all_filters')
         summary_arr = []
@@ -408,7 +452,7 @@ def _parse_news_item_body(text):
             summary += sentence
         logger.debug(f'news summary: {summary}')
 
-    return body, summary
+    return summary
 
 def _day_or_night(timestamp):
     """
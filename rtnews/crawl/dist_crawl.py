@@ -0,0 +1,278 @@
+"""
+基于redis工作队列的分布式采集。
+
+采集工作被拆分为可租用的工作单元（msgpack二进制）：
+    page: 抓取某频道滚动新闻列表的一页，并为其中每条新闻生成news工作单元
+    news: 抓取一条新闻的正文，生成摘要并存储到redis，新闻条目为SinaRollNewsItem.pack()的结果
+
+工作单元入队后内容不再改变，租约及确认均以其二进制内容为成员；尝试次数单独记录在
+work-attempts中，lua脚本无需解码工作单元。
+
+协调者(coordinator)为每个频道投放第1页的page工作单元，并根据worker回报的
+列表页结果决定是否继续投放下一页；任意多个主机上的任意多个worker进程从队列中
+租用工作单元。租用的工作单元在租约到期前未被确认时，将重新入队；
+尝试次数达到ct.WORK_MAX_ATTEMPTS的工作单元移入work-dead。
+
+redis中的key：
+    work-queue: list，待处理的工作单元，LPUSH入队，RPOP出队
+    work-leases: sorted set，已租用的工作单元，分数为租约到期时间戳
+    work-results-{run}: list，page工作单元的处理结果，由发起该轮采集的协调者消费；
+        按轮次区分，多个协调者同时运行时互不消费对方的结果
+    work-dead: list，多次重试仍失败的工作单元
+    work-attempts: hash，工作单元 -> 租约已到期的次数，确认或移入work-dead时删除
+"""
+
+from rtnews.crawl import async_crawl as ac
+from rtnews.crawl.news_item import SinaRollNewsItem
+from rtnews.crawl.summary_cache import SummaryCache
+from rtnews import cons as ct
+import asyncio
+import aioredis
+from datetime import datetime
+import json
+import msgpack
+import uuid
+import sys
+
+logger = ct.get_logger('dist_crawl', ct.LOG_LEVEL, ct.DIST_CRAWL_LOG_FILE)
+
+# 从队列中取出一个工作单元并登记租约
+_LEASE_SCRIPT = """
+local unit = redis.call('RPOP', KEYS[1])
+if unit then
+    redis.call('ZADD', KEYS[2], ARGV[1], unit)
+end
+return unit
+"""
+
+# 租约到期的工作单元重新入队，尝试次数达到上限的移入work-dead
+_REAP_SCRIPT = """
+local units = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+for _, unit in ipairs(units) do
+    redis.call('ZREM', KEYS[1], unit)
+    if redis.call('HINCRBY', KEYS[4], unit, 1) >= tonumber(ARGV[2]) then
+        redis.call('HDEL', KEYS[4], unit)
+        redis.call('LPUSH', KEYS[3], unit)
+    else
+        redis.call('LPUSH', KEYS[2], unit)
+    end
+end
+return #units
+"""
+
+# 原子地获取队列、租约、结果的长度
+_PENDING_SCRIPT = """
+return {redis.call('LLEN', KEYS[1]), redis.call('ZCARD', KEYS[2]), redis.call('LLEN', KEYS[3])}
+"""
+
+def _page_unit(run_id, global_lid, page, timeline):
+    return msgpack.packb({'id': uuid.uuid4().hex, 'type': 'page', 'run': run_id,
+                          'lid': global_lid, 'page': page, 'timeline': timeline}, use_bin_type=True)
+
+def _news_unit(run_id, news_item):
+    item = SinaRollNewsItem.from_list(news_item.to_list())
+    # 正文和摘要由处理news工作单元的worker生成
+    item.body = item.summary = None
+    return msgpack.packb({'id': uuid.uuid4().hex, 'type': 'news', 'run': run_id,
+                          'item': item.pack()}, use_bin_type=True)
+
+def _unpack_unit(raw):
+    return msgpack.unpackb(raw, raw=False)
+
+def _news_item_from_unit(unit):
+    """
+    由news工作单元还原尚未包含正文和摘要的新闻条目
+    """
+    return SinaRollNewsItem.unpack(unit['item'])
+
+async def _enqueue(redis, *units):
+    if units:
+        await redis.lpush(ct.KEY_WORK_QUEUE, *units)
+
+async def _reap(redis):
+    """
+    将租约到期的工作单元重新入队
+
+    Parameters
+    --------
+        redis: aioredis.RedisPool
+
+    Return
+    --------
+        int, 重新入队（或移入work-dead）的工作单元个数
+    """
+    n = await redis.eval(_REAP_SCRIPT,
+                         keys=[ct.KEY_WORK_LEASES, ct.KEY_WORK_QUEUE, ct.KEY_WORK_DEAD, ct.KEY_WORK_ATTEMPTS],
+                         args=[int(datetime.now().timestamp()), ct.WORK_MAX_ATTEMPTS])
+    if n:
+        logger.warning(f'Reaped {n} expired work units')
+    return n
+
+async def run_coordinator(redis):
+    """
+    协调一轮分布式采集。
+
+    为每个频道投放第1页的page工作单元，根据本轮work-results-{run}中的列表页结果投放下一页，
+    直到所有频道翻页结束且队列和租约均为空。
+
+    Parameters
+    --------
+        redis: aioredis.RedisPool
+    """
+    run_id = uuid.uuid4().hex
+    results_key = ct.KEY_WORK_RESULTS.format(run=run_id)
+    ts_now = int(datetime.now().timestamp())
+    ts_crawl = ts_now - ct.CRAWL_CYCLE_SECS
+    ts_expire = ts_now - ct.NEWS_EXPIRE_SECS # 时间戳比该值小的新闻均过期
+    logger.info(f'Coordinator start, run={run_id}, channels={ct.GLOBAL_CHANNELS}')
+
+    logger.info('Maintaining redis...')
+    await ac.maintain(redis, ts_expire)
+
+    # 各频道当前投放的页码，翻页结束的频道移出
+    pages = {lid: 1 for lid in ct.GLOBAL_CHANNELS}
+    await _enqueue(redis, *[_page_unit(run_id, lid, 1, ts_crawl) for lid in pages])
+
+    while True:
+        res = await redis.blpop(results_key, timeout=ct.WORK_POLL_SECS)
+        if res is None:
+            await _reap(redis)
+            n_queue, n_leases, n_results = await redis.eval(
+                _PENDING_SCRIPT, keys=[ct.KEY_WORK_QUEUE, ct.KEY_WORK_LEASES, results_key])
+            if n_queue or n_leases or n_results:
+                continue
+            # 工作队列已清空，仍未结束的频道的page工作单元已移入work-dead
+            for lid in pages:
+                logger.error(f'Channel pagination aborted, global_lid={lid}, page={pages[lid]}')
+            break
+        result = json.loads(res[1])
+        lid = result['lid']
+        if result['run'] != run_id or pages.get(lid) != result['page']:
+            logger.debug(f'Skip stale result: {result}')
+            continue
+        if result['next_page']:
+            pages[lid] = result['page'] + 1
+            await _enqueue(redis, _page_unit(run_id, lid, pages[lid], ts_crawl))
+        else:
+            logger.info(f'Channel crawl end. global_lid={lid}, pages={result["page"]}')
+            del pages[lid]
+    await redis.delete(results_key)
+    logger.info(f'Coordinator end, run={run_id}')
+
+async def _handle_page(redis, session, unit):
+    url = ac.roll_page_url(unit['lid'], unit['page'])
+    json_response = await ac.fetch_roll_page(session, url)
+    if json_response is None:
+        news_items, next_page = [], False
+    else:
+        news_items, next_page = ac.parse_roll_items(unit['timeline'], json_response)
+    await _enqueue(redis, *[_news_unit(unit['run'], news_item) for news_item in news_items])
+    # 结果必须在确认租约之前写入，协调者据此判断工作是否全部完成
+    results_key = ct.KEY_WORK_RESULTS.format(run=unit['run'])
+    tr = redis.multi_exec()
+    tr.rpush(results_key, json.dumps(
+        {'run': unit['run'], 'lid': unit['lid'], 'page': unit['page'], 'next_page': next_page}))
+    tr.expire(results_key, ct.WORK_RESULTS_EXPIRE_SECS)
+    await tr.execute()
+
+async def _handle_news(redis, session, summary_cache, unit):
+    news_item = _news_item_from_unit(unit)
+    if await ac.fetch_news_item_body(session, summary_cache, news_item):
+        await ac.save_news_item(redis, news_item)
+
+def _log_summary_cache(summary_cache, log_state):
+    """
+    摘要缓存的查询次数每增加100次输出一次统计，log_state记录上次输出时的查询次数
+    """
+    if summary_cache.lookups - log_state['lookups'] >= 100:
+        log_state['lookups'] = summary_cache.lookups
+        logger.info(f'Summary cache: {summary_cache}')
+
+async def _work(redis, session, summary_cache, log_state, max_idle_secs):
+    idle_secs = 0
+    while True:
+        try:
+            lease_until = int(datetime.now().timestamp()) + ct.WORK_LEASE_SECS
+            # 工作单元为二进制，不按连接池的utf-8解码
+            raw = await redis.execute(b'EVAL', _LEASE_SCRIPT, 2, ct.KEY_WORK_QUEUE, ct.KEY_WORK_LEASES,
+                                      lease_until, encoding=None)
+            if raw is None:
+                if max_idle_secs is not None and idle_secs >= max_idle_secs:
+                    break
+                # 没有协调者运行时，由worker将已崩溃worker的过期租约重新入队
+                await _reap(redis)
+                await asyncio.sleep(ct.WORK_POLL_SECS)
+                idle_secs += ct.WORK_POLL_SECS
+                continue
+            idle_secs = 0
+            unit = _unpack_unit(raw)
+            logger.debug(f'Leased work unit: {unit}')
+        except Exception as e:
+            logger.error(f'Lease work unit failed, exception: {repr(e)}')
+            await asyncio.sleep(ct.WORK_POLL_SECS)
+            continue
+        try:
+            if unit['type'] == 'page':
+                await _handle_page(redis, session, unit)
+            else:
+                await _handle_news(redis, session, summary_cache, unit)
+                _log_summary_cache(summary_cache, log_state)
+            if not await _ack(redis, raw):
+                logger.warning(f'Work unit lease lost before ack, id={unit["id"]}')
+        except Exception as e:
+            # 不确认租约，租约到期后重新入队
+            logger.error(f'Work unit failed, id={unit["id"]}, type={unit["type"]}, exception: {repr(e)}')
+
+async def _ack(redis, raw):
+    """
+    确认工作单元：删除租约及尝试次数
+
+    Return
+    --------
+        int, 租约仍存在时为1，租约已到期被回收时为0
+    """
+    tr = redis.multi_exec()
+    fut = tr.zrem(ct.KEY_WORK_LEASES, raw)
+    tr.hdel(ct.KEY_WORK_ATTEMPTS, raw)
+    await tr.execute()
+    return fut.result()
+
+async def run_worker(redis, concurrency=ct.WORK_CONCURRENCY, max_idle_secs=None):
+    """
+    从工作队列中租用并处理工作单元。
+
+    Parameters
+    --------
+        redis: aioredis.RedisPool
+        concurrency: int，本进程内并发处理的工作单元数
+        max_idle_secs: int，队列持续为空超过该时长后退出，默认None一直运行
+    """
+    logger.info(f'Worker start, concurrency={concurrency}')
+    summary_cache = SummaryCache(redis)
+    log_state = {'lookups': 0}
+    async with ac.client_session() as session:
+        tasks = [asyncio.create_task(_work(redis, session, summary_cache, log_state, max_idle_secs))
+                 for _ in range(concurrency)]
+        res = await asyncio.gather(*tasks, return_exceptions=True)
+    for i, v in enumerate(res):
+        if v != None:
+            logger.error(f'index: {i}, work task failed: {str(v)}')
+    logger.info(f'Summary cache: {summary_cache}')
+    logger.info('Worker end')
+
+async def _main(role):
+    logger.info('Creating redis pool...')
+    redis = await aioredis.create_redis_pool(ct.REDIS_URI, encoding='utf-8')
+    if role == 'coordinator':
+        await run_coordinator(redis)
+    else:
+        await run_worker(redis)
+    logger.info('Closing redis...')
+    redis.close()
+    await redis.wait_closed()
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2 or sys.argv[1] not in ('coordinator', 'worker'):
+        print(f'usage: {sys.argv[0]} coordinator|worker')
+        sys.exit(1)
+    asyncio.run(_main(sys.argv[1]))
@@ -0,0 +1,106 @@
+from rtnews import cons as ct
+from operator import attrgetter
+import msgpack
+
+# 字段顺序即序列化布局，只能在末尾追加字段，变更布局时需增加SCHEMA_VERSION
+FIELDS = ('oid', 'url', 'lids', 'title', 'timestamp', 'keywords', 'summary', 'body')
+# 列表字段在to_dict()中以逗号连接，from_dict()还原时丢弃空元素
+LIST_FIELDS = ('lids', 'keywords')
+SCHEMA_VERSION = 1
+
+_get_fields = attrgetter(*FIELDS)
+_is_list_field = tuple(name in LIST_FIELDS for name in FIELDS)
+
+class SinaRollNewsItem(object):
+    """
+    新浪滚动新闻条目信息，包含：
+
+        oid: 唯一标识
+        url: str，网址
+        lids: list(str)，所属频道id列表
+        title: str，标题
+        timestamp: str，时间戳
+        keywords: list(str)，关键字列表
+        summary: str，摘要
+        body: str，正文
+
+    使用__slots__存储字段，不为每个条目创建__dict__。
+    """
+
+    __slots__ = FIELDS
+
+    def __init__(self, oid, url=None, lids=None, title=None, timestamp=None,
+                 keywords=None, summary=None, body=None):
+        self.oid = oid
+        self.url = url
+        self.lids = lids
+        self.title = title
+        self.timestamp = timestamp
+        self.keywords = keywords
+        self.summary = summary
+        self.body = body
+
+    def __str__(self):
+        body = self.body or ''
+        if len(body) > ct.MAX_SUMMARY_SENTENCES_NUM * ct.MAX_SUMMARY_SENTENCE_WORDS_NUM:
+            half = ct.MAX_SUMMARY_SENTENCES_NUM * ct.MAX_SUMMARY_SENTENCE_WORDS_NUM // 4
+            body = body[:half] + '...' + body[0-half:]
+        return (f'SinaRollNewsItem<oid={self.oid}, url={self.url}, '
+                f'lids={self.lids}, title={self.title}, timestamp={self.timestamp}, '
+                f'keywords={self.keywords}, summary={self.summary}, body={body}>')
+
+    def to_dict(self):
+        """
+        转换为存储到redis hash的字段，列表字段以逗号连接，未设置的字段不输出
+        """
+        d = {}
+        for name, is_list, v in zip(FIELDS, _is_list_field, _get_fields(self)):
+            if v is None:
+                continue
+            d[name] = ','.join(v) if is_list else v
+        return d
+
+    @classmethod
+    def from_dict(cls, d):
+        """
+        由to_dict()的结果（如redis hash）还原新闻条目
+        """
+        item = cls(d['oid'])
+        for name, is_list in zip(FIELDS, _is_list_field):
+            if name not in d:
+                continue
+            v = d[name]
+            if is_list:
+                # 空字符串表示空列表，重复的逗号不产生空元素
+                v = [s for s in v.split(',') if s]
+            setattr(item, name, v)
+        return item
+
+    def to_list(self):
+        """
+        按FIELDS顺序转换为列表
+        """
+        return list(_get_fields(self))
+
+    @classmethod
+    def from_list(cls, values):
+        """
+        由to_list()的结果还原新闻条目
+        """
+        return cls(*values)
+
+    def pack(self):
+        """
+        序列化为msgpack二进制：[SCHEMA_VERSION, *FIELDS]，分布式采集的news工作单元以此跨节点传递新闻条目
+        """
+        return msgpack.packb((SCHEMA_VERSION,) + _get_fields(self), use_bin_type=True)
+
+    @classmethod
+    def unpack(cls, data):
+        """
+        由pack()的结果还原新闻条目
+        """
+        values = msgpack.unpackb(data, raw=False)
+        if values[0] != SCHEMA_VERSION:
+            raise ValueError(f'News item schema version mismatch, expect: {SCHEMA_VERSION}, get: {values[0]}')
+        return cls(*values[1:len(FIELDS) + 1])
@@ -0,0 +1,100 @@
+from rtnews import cons as ct
+from collections import OrderedDict
+import asyncio
+import hashlib
+
+class SummaryCache(object):
+    """
+    新闻摘要缓存，以新闻正文的哈希为key，避免相同正文重复运行TextRank。
+
+    新浪常以新的oid或url重新发布相同正文的新闻。缓存分两层：
+        进程内：有界LRU，最多ct.SUMMARY_CACHE_SIZE条
+        redis：summary-{digest}，生存时间ct.SUMMARY_CACHE_TTL_SECS，多个采集进程间共享
+
+    同一进程内对相同正文的并发查询只查询redis及生成摘要一次，其余查询等待其结果，
+    计为local_hits。
+    """
+
+    def __init__(self, redis, maxsize=ct.SUMMARY_CACHE_SIZE, ttl=ct.SUMMARY_CACHE_TTL_SECS):
+        self._redis = redis
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._local = OrderedDict()
+        # 正在查询或生成摘要的digest -> asyncio.Future
+        self._inflight = {}
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    def __str__(self):
+        lookups = self.lookups
+        ratio = (self.local_hits + self.redis_hits) / lookups if lookups else 0.0
+        return (f'SummaryCache<lookups={lookups}, local_hits={self.local_hits}, '
+                f'redis_hits={self.redis_hits}, misses={self.misses}, hit_ratio={ratio:.2%}>')
+
+    @property
+    def lookups(self):
+        return self.local_hits + self.redis_hits + self.misses
+
+    @staticmethod
+    def digest(body):
+        return hashlib.sha1(body.encode('utf-8')).hexdigest()
+
+    async def get_or_summarize(self, body, summarize):
+        """
+        获取正文对应的摘要，缓存未命中时调用summarize生成并写入缓存
+
+        Parameters
+        --------
+            body: str，新闻正文
+            summarize: callable(str) -> str，由正文生成摘要
+
+        Return
+        --------
+            str, 新闻摘要
+        """
+        digest = self.digest(body)
+        summary = self._local.get(digest)
+        if summary is not None:
+            self._local.move_to_end(digest)
+            self.local_hits += 1
+            return summary
+
+        future = self._inflight.get(digest)
+        if future is not None:
+            self.local_hits += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[digest] = future
+        try:
+            summary = await self._lookup(digest, body, summarize)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 没有等待者时避免"Future exception was never retrieved"警告
+            future.exception()
+            raise
+        finally:
+            del self._inflight[digest]
+        future.set_result(summary)
+        self._put_local(digest, summary)
+        return summary
+
+    async def _lookup(self, digest, body, summarize):
+        key = ct.KEY_SUMMARY.format(digest=digest)
+        summary = await self._redis.get(key)
+        if summary is not None:
+            self.redis_hits += 1
+        else:
+            self.misses += 1
+            summary = summarize(body)
+            await self._redis.set(key, summary, expire=self._ttl)
+        return summary
+
+    def _put_local(self, digest, summary):
+        self._local[digest] = summary
+        if len(self._local) > self._maxsize:
+            self._local.popitem(last=False)
@@ -5,6 +5,8 @@ import lxml.html
 from lxml.html import builder as E
 from lxml import etree
 import asyncio
+import json
+from email.utils import formatdate
 import time
 import os
 import sys
@@ -12,9 +14,13 @@ import traceback
 
 from rtnews import cons as ct
 from rtnews.feed import feed_vars as fv
+from rtnews.feed.news_cache import NewsCache
 
 logger = ct.get_logger('feed', ct.LOG_LEVEL, ct.FEED_LOG_FILE)
 
+# 进程内新闻读缓存，长期运行的读取方必须以任务方式运行news_cache.listen(redis)接收失效通知
+news_cache = NewsCache(fv.NEWS_CACHE_SIZE)
+
 async def get_latest_news(redis, channel, top=None, timeline=None, show_Body=False):
     """
     获取前top条时间大于timeline的即时新闻
@@ -36,6 +42,9 @@ async def get_latest_news(redis, channel, top=None, timeline=None, show_Body=Fal
             time: 时间
             url: 新闻链接
             body: 正文（在show_content为True的情况下出现）
+
+    在同一进程内反复调用时，新闻元数据由news_cache缓存，调用方需以任务方式运行
+    news_cache.listen(redis)，见NewsCache。
     """
     lname = ''
     lid = ''
@@ -54,48 +63,120 @@ async def get_latest_news(redis, channel, top=None, timeline=None, show_Body=Fal
     logger.info(f'Getting latest news, channel name: {lname}, channel id: {lid}')
    
     lid_key = ct.KEY_LID.format(lid=lid)
-    end = -1 if top is None else top
-    logger.debug(f'Redis zrevrange, key={lid_key}, start=0, end={end}')
-    news_keys = await redis.zrevrange(lid_key, 0, end)
+    news_keys = await _zrevrange_alive(redis, lid_key, top, timeline)
     logger.debug(f'news_keys={news_keys}')
     logger.info(f'Found {len(news_keys)} news in channel {lname}. Processing...')
 
     data = []
+    news_rows = await _read_news(redis, news_keys)
+    bodies = await _read_bodies(redis, [key for key in news_keys if key in news_rows]) if show_Body else {}
     for news_key in news_keys:
-        logger.debug(f'Redis hgetall, key={news_key}')
-        news = await redis.hgetall(news_key)
-        # 每次抓取网页时候才会清理频道zset中的过期新闻key，
-        # 而过期的新闻是由redis自动根据生存时间实时删除的，
-        # 因此存在频道zset中的新闻key已经过期的情况
-        if not news:
+        row = news_rows.get(news_key)
+        if row is None:
+            continue
+        data.append([lname, row['title'], row['summary'], row['time'], row['url']] +
+                    ([bodies.get(news_key) or ''] if show_Body else []))
+    df = pd.DataFrame(data, columns=fv.LATEST_COLS_C if show_Body else fv.LATEST_COLS)
+    return df
+
+def _zrevrange_alive(redis, lid_key, top=None, timeline=None):
+    """
+    按时间戳倒序获取频道内未过期的新闻key
+
+    新闻hash在 时间戳+NEWS_EXPIRE_SECS 时由redis自动删除，因此只读取分数大于
+    当前时间-NEWS_EXPIRE_SECS 的key，不会读到已过期的新闻
+
+    Parameters
+    -------
+        redis: aioredis.RedisPool或aioredis.Pipeline
+        lid_key: str, 频道zset的key
+        top: int, 最多获取多少条新闻，默认None全获取
+        timeline: int, 时间戳，获取不小于该时间戳的新闻，默认None全获取
+
+    Result
+    -------
+        awaitable, 结果为新闻key列表
+    """
+    ts_expire = int(datetime.now().timestamp()) - ct.NEWS_EXPIRE_SECS
+    kwargs = {} if top is None else {'offset': 0, 'count': top}
+    if timeline is not None and timeline > ts_expire:
+        logger.debug(f'Redis zrevrangebyscore, key={lid_key}, min={timeline}, {kwargs}')
+        return redis.zrevrangebyscore(lid_key, min=timeline, **kwargs)
+    logger.debug(f'Redis zrevrangebyscore, key={lid_key}, min=({ts_expire}, {kwargs}')
+    return redis.zrevrangebyscore(lid_key, min=ts_expire, exclude=redis.ZSET_EXCLUDE_MIN, **kwargs)
+
+async def _read_news(redis, news_keys):
+    """
+    读取多条新闻的元数据，每个key只读取一次：先查进程内缓存，未命中的通过一次pipeline
+    从redis读取fv.NEWS_META_FIELDS字段，不读取正文
+
+    Parameters
+    -------
+        redis: aioredis.RedisPool
+        news_keys: iterable(str), 新闻key
+
+    Result
+    -------
+        dict, 新闻key -> 新闻dict，包括title、summary、time、url、timestamp；
+            新闻hash不存在或解析失败的key不出现在结果中
+    """
+    news_keys = list(dict.fromkeys(news_keys))
+    news_rows = news_cache.get_many(news_keys)
+    news_keys = [news_key for news_key in news_keys if news_key not in news_rows]
+    if not news_keys:
+        return news_rows
+    pipe = redis.pipeline()
+    futs = [pipe.hmget(news_key, *fv.NEWS_META_FIELDS) for news_key in news_keys]
+    await pipe.execute()
+
+    for news_key, fut in zip(news_keys, futs):
+        news = dict(zip(fv.NEWS_META_FIELDS, fut.result()))
+        # 只读取未过期的新闻key，仅在新闻hash被手动删除时才会不存在
+        if news['timestamp'] is None:
             continue
         logger.debug(f'raw news from redis: {news}')
         try:
-            if timeline and int(news['timestamp']) < timeline:
-                logger.debug(f'news_time={int(news["timestamp"])}, timeline={timeline}, skip this news')
-                continue
-            rt = datetime.fromtimestamp(int(news['timestamp']))
-            rtstr = datetime.strftime(rt, "%m-%d %H:%M")
-            row = [lname, news['title'], news['summary'], rtstr, news['url']]
-            if show_Body:
-                row.append(news['body'])
+            news_rows[news_key] = _news_row(news)
+            news_cache.put(news_key, news_rows[news_key])
         except Exception as e:
             logger.error(f'process raw news failed, exception: {repr(e)}')
             traceback.print_exc()
-        data.append(row)
-        logger.debug(f'news processed as a list: {row}')
-    df = pd.DataFrame(data, columns=fv.LATEST_COLS_C if show_Body else fv.LATEST_COLS)
-    return df
+    return news_rows
 
-async def feeds_txt(redis, lid):
-    timeline = int(datetime.now().timestamp()) - fv.FEED_NEWS_TIMELINE
-    df = await get_latest_news(redis, lid, top=fv.FEED_NEWS_TOP, timeline=timeline)
-    txt_file = os.path.join(ct.DAT_DIR, f'{ct.GLOBAL_CHANNELS[lid]}.txt')
+async def _read_bodies(redis, news_keys):
+    """
+    通过一次pipeline读取多条新闻的正文，正文不进入读缓存
+
+    Result
+    -------
+        dict, 新闻key -> 正文，新闻hash不存在时为None
+    """
+    if not news_keys:
+        return {}
+    pipe = redis.pipeline()
+    futs = [pipe.hget(news_key, 'body') for news_key in news_keys]
+    await pipe.execute()
+    return {news_key: fut.result() for news_key, fut in zip(news_keys, futs)}
+
+def _news_row(news):
+    timestamp = int(news['timestamp'])
+    rt = datetime.fromtimestamp(timestamp)
+    return {'title': news['title'], 'summary': news['summary'],
+            'time': datetime.strftime(rt, "%m-%d %H:%M"), 'url': news['url'],
+            'timestamp': timestamp}
+
+def _feed_title(lid):
+    return f'{ct.GLOBAL_CHANNELS[lid]}实时新闻摘要'
+
+def _feed_file(lid, fmt):
+    return os.path.join(ct.DAT_DIR, f'{ct.GLOBAL_CHANNELS[lid]}{fv.FEED_FILE_EXTS[fmt]}')
+
+def _render_txt(lid, rows):
+    txt_file = _feed_file(lid, 'txt')
     logger.info(f'Writing text to file: {txt_file}')
     news_count = 0
     with open(txt_file, 'w', encoding='utf-8') as f:
-        for row in df.iterrows():
-            row = row[1]
+        for row in rows:
             news = row['title'] + '\n' + row['time'] + '\n' + row['url'] + '\n' + row['summary'] + '\n'
             f.write(news)
             f.write('---\n\n')
@@ -103,23 +184,18 @@ async def feeds_txt(redis, lid):
             logger.debug(f'Append one news to file, news: {news}')
     logger.info(f'news count: {news_count} ')
 
-
-async def feeds_html(redis, lid):
-    timeline = int(datetime.now().timestamp()) - fv.FEED_NEWS_TIMELINE
-    df = await get_latest_news(redis, lid, top=fv.FEED_NEWS_TOP, timeline=timeline)
+def _render_html(lid, rows):
     html = E.HTML(
         E.HEAD(
             E.META(content='text/html', charset='utf-8'),
             E.LINK(rel='stylesheet', href='../css/style.css', type='text/css'),
-            E.TITLE(E.CLASS('title'), f'{ct.GLOBAL_CHANNELS[lid]}实时新闻摘要')
+            E.TITLE(E.CLASS('title'), _feed_title(lid))
         )
     )
     body = etree.SubElement(html, 'body')
-    logger.debug(f'html: {lxml.html.tostring(html, pretty_print=True, encoding="utf-8").decode("utf-8")}')
 
     news_count = 0
-    for row in df.iterrows():
-        row = row[1]
+    for row in rows:
         div = etree.SubElement(body, 'div')
         h1 = etree.SubElement(div, 'h1', attrib={'class': 'heading'})
         a = etree.SubElement(h1, 'a', attrib={'href': row['url']})
@@ -128,31 +204,150 @@ async def feeds_html(redis, lid):
         p1.text = row['time']
         p2 = etree.SubElement(div, 'p', attrib={'class': 'summary'})
         p2.text = row['summary']
-        logger.debug(f'Append one news to html body, news: {etree.tostring(div, pretty_print=True, encoding="utf-8").decode("utf-8")}')
         news_count = news_count + 1
 
-    html_file = os.path.join(ct.DAT_DIR, f'{ct.GLOBAL_CHANNELS[lid]}.html')
+    html_file = _feed_file(lid, 'html')
     logger.info(f'Writing html to file: {html_file}, news count: {news_count}')
     with open(html_file, 'w', encoding='utf-8') as f:
         f.write(lxml.html.tostring(html, pretty_print=True, encoding='utf-8').decode('utf-8'))
 
-async def feeds():
-    logger.info('Creating redis pool...')
-    redis = await aioredis.create_redis_pool(ct.REDIS_URI, encoding='utf-8')
-    logger.info(f'Creating tasks...')
-    tasks = [asyncio.create_task(feeds_html(redis, lid)) for lid in ct.GLOBAL_CHANNELS]
-    logger.info(f'Created {len(tasks)} tasks, task=feeds_html')
-
-    logger.info('Gathering feeding tasks...')
-    res = await asyncio.gather(*tasks, return_exceptions=True)
-    logger.debug(f'tasks return: {res}')
-    for i in res:
-        if i != None:
-            logger.error(f'task failed: {repr(i)}')
-
-    logger.info('Closing redis...')
-    redis.close()
-    await redis.wait_closed()
+def _render_rss(lid, rows):
+    rss = etree.Element('rss', attrib={'version': '2.0'})
+    channel = etree.SubElement(rss, 'channel')
+    etree.SubElement(channel, 'title').text = _feed_title(lid)
+    etree.SubElement(channel, 'link').text = fv.FEED_SITE_URL
+    etree.SubElement(channel, 'description').text = _feed_title(lid)
+    etree.SubElement(channel, 'lastBuildDate').text = formatdate(localtime=True)
+    for row in rows:
+        item = etree.SubElement(channel, 'item')
+        etree.SubElement(item, 'title').text = row['title']
+        etree.SubElement(item, 'link').text = row['url']
+        etree.SubElement(item, 'description').text = row['summary']
+        etree.SubElement(item, 'pubDate').text = formatdate(row['timestamp'], localtime=True)
+        etree.SubElement(item, 'guid', attrib={'isPermaLink': 'true'}).text = row['url']
+
+    rss_file = _feed_file(lid, 'rss')
+    logger.info(f'Writing rss to file: {rss_file}, news count: {len(rows)}')
+    with open(rss_file, 'wb') as f:
+        f.write(etree.tostring(rss, pretty_print=True, encoding='utf-8', xml_declaration=True))
+
+def _render_atom(lid, rows):
+    ns = 'http://www.w3.org/2005/Atom'
+    updated = max([row['timestamp'] for row in rows], default=int(datetime.now().timestamp()))
+    feed = etree.Element(f'{{{ns}}}feed', nsmap={None: ns})
+    etree.SubElement(feed, f'{{{ns}}}title').text = _feed_title(lid)
+    etree.SubElement(feed, f'{{{ns}}}id').text = f'{fv.FEED_SITE_URL}#lid={lid}'
+    etree.SubElement(feed, f'{{{ns}}}link', attrib={'href': fv.FEED_SITE_URL})
+    etree.SubElement(feed, f'{{{ns}}}updated').text = _isoformat(updated)
+    # 条目未提供作者时使用订阅源级别的作者
+    author = etree.SubElement(feed, f'{{{ns}}}author')
+    etree.SubElement(author, f'{{{ns}}}name').text = fv.FEED_AUTHOR
+    for row in rows:
+        entry = etree.SubElement(feed, f'{{{ns}}}entry')
+        etree.SubElement(entry, f'{{{ns}}}title').text = row['title']
+        etree.SubElement(entry, f'{{{ns}}}id').text = row['url']
+        etree.SubElement(entry, f'{{{ns}}}link', attrib={'href': row['url']})
+        etree.SubElement(entry, f'{{{ns}}}updated').text = _isoformat(row['timestamp'])
+        etree.SubElement(entry, f'{{{ns}}}summary').text = row['summary']
+
+    atom_file = _feed_file(lid, 'atom')
+    logger.info(f'Writing atom to file: {atom_file}, news count: {len(rows)}')
+    with open(atom_file, 'wb') as f:
+        f.write(etree.tostring(feed, pretty_print=True, encoding='utf-8', xml_declaration=True))
+
+def _render_json(lid, rows):
+    feed = {
+        'version': 'https://jsonfeed.org/version/1.1',
+        'title': _feed_title(lid),
+        'home_page_url': fv.FEED_SITE_URL,
+        'language': 'zh-CN',
+        'items': [{'id': row['url'], 'url': row['url'], 'title': row['title'],
+                   'summary': row['summary'], 'content_text': row['summary'],
+                   'date_published': _isoformat(row['timestamp'])} for row in rows],
+    }
+    json_file = _feed_file(lid, 'json')
+    logger.info(f'Writing json feed to file: {json_file}, news count: {len(rows)}')
+    with open(json_file, 'w', encoding='utf-8') as f:
+        json.dump(feed, f, ensure_ascii=False, indent=2)
+
+def _isoformat(timestamp):
+    return datetime.fromtimestamp(timestamp).astimezone().isoformat()
+
+# 订阅文件格式 -> 生成函数(lid, rows)
+RENDERERS = {
+    'txt': _render_txt,
+    'html': _render_html,
+    'rss': _render_rss,
+    'atom': _render_atom,
+    'json': _render_json,
+}
+
+async def build_feeds(redis, lids=None, formats=None):
+    """
+    一次读取、多格式多频道输出订阅文件
+
+    先通过一次pipeline读取各频道的新闻key，再通过一次pipeline读取所有频道新闻key的并集，
+    每条新闻只从redis读取一次，然后分发到其所属的每个频道和每种订阅格式。
+
+    Parameters
+    -------
+        redis: aioredis.RedisPool
+        lids: list(str), 频道id列表，默认None为全部频道
+        formats: list(str), 订阅文件格式，取值见RENDERERS，默认None为fv.FEED_FORMATS
+    """
+    lids = list(ct.GLOBAL_CHANNELS) if lids is None else lids
+    formats = fv.FEED_FORMATS if formats is None else formats
+    for fmt in formats:
+        if fmt not in RENDERERS:
+            raise ValueError(f'Parameter "formats": value "{fmt}" undefined.')
+    os.makedirs(ct.DAT_DIR, exist_ok=True)
+    timeline = int(datetime.now().timestamp()) - fv.FEED_NEWS_TIMELINE
+
+    pipe = redis.pipeline()
+    futs = [_zrevrange_alive(pipe, ct.KEY_LID.format(lid=lid), fv.FEED_NEWS_TOP, timeline) for lid in lids]
+    await pipe.execute()
+    channel_keys = {lid: fut.result() for lid, fut in zip(lids, futs)}
+
+    news_rows = await _read_news(redis, [key for keys in channel_keys.values() for key in keys])
+    logger.info(f'Read {len(news_rows)} news for {len(lids)} channels, formats={formats}, cache: {news_cache}')
+
+    for lid, keys in channel_keys.items():
+        rows = [news_rows[key] for key in keys if key in news_rows]
+        for fmt in formats:
+            try:
+                RENDERERS[fmt](lid, rows)
+            except Exception as e:
+                logger.error(f'render {fmt} feed failed, lid={lid}, exception: {repr(e)}')
+                traceback.print_exc()
+
+async def feeds_txt(redis, lid):
+    await build_feeds(redis, [lid], ['txt'])
+
+async def feeds_html(redis, lid):
+    await build_feeds(redis, [lid], ['html'])
+
+async def feeds(redis=None):
+    """
+    为每个新闻频道生成订阅文件
+
+    Parameters
+    -------
+        redis: aioredis.RedisPool，默认None时自行创建并在结束时关闭
+    """
+    own_redis = redis is None
+    if own_redis:
+        logger.info('Creating redis pool...')
+        redis = await aioredis.create_redis_pool(ct.REDIS_URI, encoding='utf-8')
+
+    try:
+        await build_feeds(redis)
+    except Exception as e:
+        logger.error(f'build feeds failed: {repr(e)}')
+
+    if own_redis:
+        logger.info('Closing redis...')
+        redis.close()
+        await redis.wait_closed()
 
 if __name__ == '__main__':
     #try:
@@ -1,6 +1,18 @@
 LATEST_COLS_C = ['channel', 'title', 'summary', 'time', 'url', 'body']
 LATEST_COLS = ['channel', 'title', 'summary', 'time', 'url']
+# 读取及缓存的新闻hash字段，正文只在需要时单独读取，不进入读缓存
+NEWS_META_FIELDS = ['title', 'summary', 'url', 'timestamp']
 # 订阅新闻最大条数
 FEED_NEWS_TOP = None
 # 时间线过滤订阅新闻（时间线=当前时间-FEED_NEWS_TIMELINE）
-FEED_NEWS_TIMELINE = 12 * 60 * 60
\ No newline at end of file
+FEED_NEWS_TIMELINE = 12 * 60 * 60
+# 订阅文件格式，可选：html、txt、rss、atom、json，默认只生成html
+FEED_FORMATS = ['html']
+# 各格式订阅文件的扩展名
+FEED_FILE_EXTS = {'html': '.html', 'txt': '.txt', 'rss': '.rss.xml', 'atom': '.atom.xml', 'json': '.json'}
+# 订阅源主页
+FEED_SITE_URL = 'https://news.sina.com.cn/roll/'
+# 订阅源作者（atom必需）
+FEED_AUTHOR = '新浪新闻'
+# 新闻读缓存最大条数
+NEWS_CACHE_SIZE = 4096
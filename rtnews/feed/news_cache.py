@@ -0,0 +1,101 @@
+from rtnews import cons as ct
+from collections import OrderedDict
+from datetime import datetime
+
+class NewsCache(object):
+    """
+    已解析新闻元数据（标题、摘要、链接、时间，不含正文）的进程内读缓存，有界LRU，以新闻key为key。
+
+    新闻写入后不会被覆盖，因此缓存条目只在以下情况失效：
+        新闻过期：时间戳+NEWS_EXPIRE_SECS到达时，读取时淘汰
+        新闻hash被删除：采集端维护频道zset、清理对应新闻hash已不存在的key时，
+            在ct.CHANNEL_NEWS_INVALIDATE频道发布通知，由listen()接收
+
+    缓存只对在同一进程内反复调用get_latest_news的长期运行的读取方有效，这类读取方必须
+    以任务方式运行listen()，否则新闻hash被删除后仍会返回缓存中的内容。python -m rtnews
+    feed|run每次在新进程中运行，build_feeds对新闻key去重后只读取一次，不会命中缓存，
+    也无需运行listen()。
+    """
+
+    def __init__(self, maxsize):
+        self._maxsize = maxsize
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __str__(self):
+        lookups = self.hits + self.misses
+        ratio = self.hits / lookups if lookups else 0.0
+        return (f'NewsCache<size={len(self._entries)}, hits={self.hits}, '
+                f'misses={self.misses}, hit_ratio={ratio:.2%}>')
+
+    def get_many(self, news_keys):
+        """
+        获取缓存中的新闻
+
+        Parameters
+        -------
+            news_keys: iterable(str), 新闻key
+
+        Result
+        -------
+            dict, 新闻key -> 新闻dict，只包含缓存命中且未过期的key
+        """
+        ts_now = int(datetime.now().timestamp())
+        found = {}
+        for news_key in news_keys:
+            entry = self._entries.get(news_key)
+            if entry is not None and entry[0] <= ts_now:
+                del self._entries[news_key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                continue
+            self._entries.move_to_end(news_key)
+            found[news_key] = entry[1]
+            self.hits += 1
+        return found
+
+    def put(self, news_key, news):
+        """
+        缓存一条新闻
+
+        Parameters
+        -------
+            news_key: str, 新闻key
+            news: dict, 已解析的新闻，必须包含timestamp(int)
+        """
+        self._entries[news_key] = (news['timestamp'] + ct.NEWS_EXPIRE_SECS, news)
+        self._entries.move_to_end(news_key)
+        while len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, news_key):
+        self._entries.pop(news_key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    async def listen(self, redis):
+        """
+        订阅采集端的失效通知，持续运行直到任务被取消。长期运行的读取方在首次调用
+        get_latest_news之前以任务方式运行：
+
+            task = asyncio.create_task(news_cache.listen(redis))
+
+        Parameters
+        -------
+            redis: aioredis.RedisPool
+        """
+        channel, = await redis.subscribe(ct.CHANNEL_NEWS_INVALIDATE)
+        try:
+            async for news_key in channel.iter(encoding='utf-8'):
+                self.invalidate(news_key)
+        finally:
+            # 停止订阅后会错过失效通知，清空缓存
+            self.clear()
+            if not redis.closed:
+                await redis.unsubscribe(ct.CHANNEL_NEWS_INVALIDATE)
@@ -47,12 +47,18 @@ def get_latest_news(channel, top=None, show_Body=False):
     client = redis.from_url(ct.REDIS_URI, decode_responses=True)
     
     lid_key = ct.KEY_LID.format(lid=lid)
-    end = -1 if top is None else top
-    news_keys = client.zrevrange(lid_key, 0, end) 
+    # 新闻hash在 时间戳+NEWS_EXPIRE_SECS 时过期，只读取未过期的新闻key
+    ts_expire = int(datetime.now().timestamp()) - ct.NEWS_EXPIRE_SECS
+    if top is None:
+        news_keys = client.zrevrangebyscore(lid_key, '+inf', f'({ts_expire}')
+    else:
+        news_keys = client.zrevrangebyscore(lid_key, '+inf', f'({ts_expire}', start=0, num=top)
     
     data = []
     for news_key in news_keys:
         news = client.hgetall(news_key)
+        if not news:
+            continue
         rt = datetime.fromtimestamp(int(news['timestamp']))
         rtstr = datetime.strftime(rt, "%m-%d %H:%M")
         row = [lname, news['title'], news['summary'], rtstr, news['url']]
@@ -63,6 +69,7 @@ def get_latest_news(channel, top=None, show_Body=False):
     return df
 
 def feeds_txt():
+    os.makedirs(ct.DAT_DIR, exist_ok=True)
     for lid in ct.GLOBAL_CHANNELS:
         df = get_latest_news(lid)
         with open(os.path.join(ct.DAT_DIR, f'{ct.GLOBAL_CHANNELS[lid]}.txt'), 'w', encoding='utf-8') as f:
@@ -73,6 +80,7 @@ def feeds_txt():
                 f.write('---\n\n')
 
 def feeds_html():
+    os.makedirs(ct.DAT_DIR, exist_ok=True)
     for lid in ct.GLOBAL_CHANNELS:
         df = get_latest_news(lid)
         html = E.HTML(
@@ -0,0 +1,94 @@
+import os
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip('pyarrow')
+pytest.importorskip('aioredis')
+
+from rtnews.archive import archive_vars as av
+from rtnews.archive import news_archive as na
+
+DAY = '2020-01-01'
+BASE_TS = int(datetime(2020, 1, 1).timestamp())
+
+def _news(i, lids='100,101'):
+    return {'oid': f'comos:{i}', 'url': f'https://news.sina.com.cn/{i}.shtml', 'lids': lids,
+            'title': f'标题{i}', 'timestamp': str(BASE_TS + i * 3600),
+            'keywords': '关键字,新闻', 'summary': f'摘要{i}', 'body': f'正文{i}'}
+
+@pytest.fixture(autouse=True)
+def archive_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(av, 'ARCHIVE_DIR', str(tmp_path))
+    # logger在导入时已绑定dat/archive.log，测试中不写入仓库目录
+    monkeypatch.setattr(na.logger, 'handlers', [])
+    return tmp_path
+
+def test_read_archive_filters_channel_and_time_range():
+    na._write_partition(DAY, [_news(i, '100,101' if i % 2 else '100') for i in range(10)])
+
+    table = na.read_archive('国内', start=BASE_TS + 2 * 3600, end=BASE_TS + 8 * 3600,
+                            columns=['title', 'timestamp'])
+
+    assert table.column_names == ['title', 'timestamp']
+    assert table.column('title').to_pylist() == ['标题3', '标题5', '标题7']
+
+def test_read_archive_returns_all_columns():
+    na._write_partition(DAY, [_news(0)])
+
+    row = {col: values[0] for col, values in na.read_archive().to_pydict().items()}
+
+    assert row['lids'] == ['100', '101']
+    assert row['keywords'] == ['关键字', '新闻']
+    assert row['timestamp'] == BASE_TS
+
+def test_read_archive_dedupes_by_oid():
+    na._write_partition(DAY, [_news(0), _news(1)])
+    na._write_partition(DAY, [_news(1), _news(2)])
+
+    # 同一秒写入的分区文件之间顺序不确定，只比较去重后的集合
+    oids = na.read_archive(columns=['oid']).column('oid').to_pylist()
+
+    assert sorted(oids) == ['comos:0', 'comos:1', 'comos:2']
+
+def test_read_archive_skips_other_days():
+    na._write_partition(DAY, [_news(0)])
+    na._write_partition('2020-01-03', [_news(48)])
+
+    table = na.read_archive(end=BASE_TS + 24 * 3600, columns=['oid'])
+
+    assert table.column('oid').to_pylist() == ['comos:0']
+
+def test_read_archive_ignores_stray_files(archive_dir):
+    (archive_dir / 'README').write_text('not a partition')
+    na._write_partition(DAY, [_news(0)])
+
+    assert na.read_archive().num_rows == 1
+
+def test_read_archive_rejects_unknown_channel():
+    with pytest.raises(ValueError):
+        na.read_archive('未知')
+
+def test_compact_partitions_merges_parts(archive_dir, monkeypatch):
+    monkeypatch.setattr(av, 'ARCHIVE_BATCH_ROWS', 2)
+    na._write_partition(DAY, [_news(3), _news(1)])
+    na._write_partition(DAY, [_news(2), _news(1)])
+    na._write_partition('2020-01-02', [_news(30)])
+
+    na.compact_partitions('2020-01-02')
+
+    assert os.listdir(archive_dir / f'date={DAY}') == [av.COMPACT_FILE]
+    assert len(os.listdir(archive_dir / 'date=2020-01-02')) == 1
+    assert os.listdir(archive_dir / 'date=2020-01-02') != [av.COMPACT_FILE]
+    oids = na.read_archive(end=BASE_TS + 24 * 3600, columns=['oid']).column('oid').to_pylist()
+    assert oids == ['comos:1', 'comos:2', 'comos:3']
+
+def test_compact_partitions_merges_new_parts_into_compacted_file(archive_dir):
+    na._write_partition(DAY, [_news(1)])
+    na.compact_partitions('2020-01-02')
+    na._write_partition(DAY, [_news(2)])
+
+    na.compact_partitions('2020-01-02')
+
+    assert os.listdir(archive_dir / f'date={DAY}') == [av.COMPACT_FILE]
+    assert na.read_archive(columns=['oid']).column('oid').to_pylist() == ['comos:1', 'comos:2']
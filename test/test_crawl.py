@@ -0,0 +1,192 @@
+import asyncio
+
+import pytest
+
+msgpack = pytest.importorskip('msgpack')
+
+from rtnews import cons as ct
+from rtnews.crawl import news_item as ni
+from rtnews.crawl.news_item import SinaRollNewsItem
+from rtnews.crawl.summary_cache import SummaryCache
+
+def _item(**kwargs):
+    fields = {'url': 'https://finance.sina.com.cn/stock/doc-iihnzahi0000001.shtml',
+              'lids': ['100', '108'], 'title': '央行：保持流动性合理充裕', 'timestamp': '1576800000',
+              'keywords': ['央行', '流动性'], 'summary': '摘要', 'body': '正文\n第二段'}
+    fields.update(kwargs)
+    return SinaRollNewsItem('comos:ihnzahi0000001', **fields)
+
+def _fields(item):
+    return [getattr(item, name) for name in ni.FIELDS]
+
+def test_to_dict_joins_list_fields():
+    d = _item().to_dict()
+
+    assert d['lids'] == '100,108'
+    assert d['keywords'] == '央行,流动性'
+    assert d['oid'] == 'comos:ihnzahi0000001'
+
+def test_to_dict_skips_unset_fields():
+    d = _item(summary=None, body=None).to_dict()
+
+    assert 'summary' not in d
+    assert 'body' not in d
+
+def test_dict_round_trip():
+    item = _item()
+
+    assert _fields(SinaRollNewsItem.from_dict(item.to_dict())) == _fields(item)
+
+def test_from_dict_drops_empty_list_elements():
+    item = SinaRollNewsItem.from_dict({'oid': 'comos:1', 'lids': '100,,108', 'keywords': ''})
+
+    assert item.lids == ['100', '108']
+    assert item.keywords == []
+    assert item.title is None
+
+def test_pack_round_trip():
+    item = _item()
+
+    assert _fields(SinaRollNewsItem.unpack(item.pack())) == _fields(item)
+
+def test_pack_round_trip_keeps_unset_fields():
+    item = SinaRollNewsItem('comos:1', title='标题')
+
+    assert _fields(SinaRollNewsItem.unpack(item.pack())) == _fields(item)
+
+def test_unpack_rejects_other_schema_version():
+    data = msgpack.packb([ni.SCHEMA_VERSION + 1] + _fields(_item()), use_bin_type=True)
+
+    with pytest.raises(ValueError):
+        SinaRollNewsItem.unpack(data)
+
+def test_list_round_trip():
+    item = _item()
+
+    assert _fields(SinaRollNewsItem.from_list(item.to_list())) == _fields(item)
+
+class FakeRedis(object):
+    def __init__(self):
+        self.data = {}
+        self.gets = 0
+
+    async def get(self, key):
+        self.gets += 1
+        await asyncio.sleep(0)
+        return self.data.get(key)
+
+    async def set(self, key, value, expire=None):
+        self.data[key] = value
+
+class Summarizer(object):
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, body):
+        self.calls += 1
+        return '摘要:' + body
+
+def test_summary_cache_counts_misses_and_local_hits():
+    cache, summarize = SummaryCache(FakeRedis()), Summarizer()
+
+    async def run():
+        return [await cache.get_or_summarize(body, summarize) for body in ('正文1', '正文2', '正文1')]
+
+    assert asyncio.run(run()) == ['摘要:正文1', '摘要:正文2', '摘要:正文1']
+    assert (cache.local_hits, cache.redis_hits, cache.misses) == (1, 0, 2)
+    assert summarize.calls == 2
+
+def test_summary_cache_shares_summaries_through_redis():
+    redis, summarize = FakeRedis(), Summarizer()
+    asyncio.run(SummaryCache(redis).get_or_summarize('正文', summarize))
+    cache = SummaryCache(redis)
+
+    assert asyncio.run(cache.get_or_summarize('正文', summarize)) == '摘要:正文'
+    assert (cache.local_hits, cache.redis_hits, cache.misses) == (0, 1, 0)
+    assert summarize.calls == 1
+
+def test_summary_cache_evicts_least_recently_used():
+    redis, summarize = FakeRedis(), Summarizer()
+    cache = SummaryCache(redis, maxsize=2)
+
+    async def run():
+        for body in ('正文1', '正文2', '正文1', '正文3', '正文1', '正文2'):
+            await cache.get_or_summarize(body, summarize)
+
+    asyncio.run(run())
+
+    # 正文2在正文3写入时被淘汰，再次查询时由redis命中
+    assert (cache.local_hits, cache.redis_hits, cache.misses) == (2, 1, 3)
+
+def test_summary_cache_dedupes_concurrent_lookups():
+    redis, summarize = FakeRedis(), Summarizer()
+    cache = SummaryCache(redis)
+
+    async def run():
+        return await asyncio.gather(*[cache.get_or_summarize('正文', summarize) for _ in range(5)])
+
+    assert asyncio.run(run()) == ['摘要:正文'] * 5
+    assert redis.gets == 1
+    assert summarize.calls == 1
+    assert (cache.local_hits, cache.redis_hits, cache.misses) == (4, 0, 1)
+    assert cache.lookups == 5
+
+def test_summary_cache_propagates_errors_to_concurrent_lookups():
+    cache = SummaryCache(FakeRedis())
+
+    def summarize(body):
+        raise RuntimeError('textrank failed')
+
+    async def run():
+        return await asyncio.gather(*[cache.get_or_summarize('正文', summarize) for _ in range(3)],
+                                    return_exceptions=True)
+
+    assert all(isinstance(e, RuntimeError) for e in asyncio.run(run()))
+    # 失败的查询不缓存，之后的查询重新生成摘要
+    assert asyncio.run(cache.get_or_summarize('正文', Summarizer())) == '摘要:正文'
+
+@pytest.fixture
+def lua_redis():
+    """
+    在fakeredis中执行lua脚本（依赖lupa，Lua 5.1，与redis服务端一致）
+    """
+    fakeredis = pytest.importorskip('fakeredis')
+    pytest.importorskip('lupa')
+    return fakeredis.FakeRedis(decode_responses=True)
+
+def _sweep(lua_redis, key, ts_expire):
+    pytest.importorskip('aiohttp')
+    from rtnews.crawl import async_crawl as ac
+    pubsub = lua_redis.pubsub()
+    pubsub.subscribe(ct.CHANNEL_NEWS_INVALIDATE)
+    pubsub.get_message(timeout=0.1)
+    removed = lua_redis.eval(ac._SWEEP_LID_ZSET_SCRIPT, 1, key, ts_expire, ct.CHANNEL_NEWS_INVALIDATE)
+    published = []
+    message = pubsub.get_message(timeout=0.1)
+    while message is not None:
+        published.append(message['data'])
+        message = pubsub.get_message(timeout=0.1)
+    return removed, published
+
+def test_sweep_lid_zset_removes_expired_and_deleted_news(lua_redis):
+    key = ct.KEY_LID.format(lid='100')
+    lua_redis.zadd(key, {'news-old': 100, 'news-edge': 200, 'news-live': 300, 'news-deleted': 300})
+    for news_key in ('news-old', 'news-edge', 'news-live'):
+        lua_redis.hset(news_key, 'title', news_key)
+
+    removed, published = _sweep(lua_redis, key, 200)
+
+    assert removed == 3
+    assert lua_redis.zrange(key, 0, -1) == ['news-live']
+    # 只有新闻hash已被删除的key需要通知读取方，过期的key不会再被读取
+    assert published == ['news-deleted']
+
+def test_sweep_lid_zset_removes_deleted_news_in_chunks(lua_redis):
+    key = ct.KEY_LID.format(lid='100')
+    lua_redis.zadd(key, {f'news-{i}': 300 for i in range(2500)})
+    lua_redis.hset('news-7', 'title', '标题')
+
+    removed, published = _sweep(lua_redis, key, 200)
+
+    assert removed == 2499
+    assert lua_redis.zrange(key, 0, -1) == ['news-7']
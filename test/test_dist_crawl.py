@@ -0,0 +1,342 @@
+import asyncio
+import json
+import logging
+from collections import defaultdict
+
+import pytest
+
+pytest.importorskip('aioredis')
+pytest.importorskip('aiohttp')
+msgpack = pytest.importorskip('msgpack')
+
+from rtnews import cons as ct
+from rtnews.crawl import async_crawl as ac
+from rtnews.crawl import dist_crawl as dc
+from rtnews.crawl.news_item import SinaRollNewsItem
+from rtnews.crawl.summary_cache import SummaryCache
+
+class FakeTransaction(object):
+    def __init__(self, redis):
+        self._redis = redis
+        self._ops = []
+
+    def rpush(self, key, *values):
+        self._ops.append(lambda: self._redis._rpush(key, *values))
+
+    def zrem(self, key, member):
+        return self._op(lambda: 0 if self._redis.zsets[key].pop(member, None) is None else 1)
+
+    def hdel(self, key, field):
+        return self._op(lambda: 0 if self._redis.hashes[key].pop(field, None) is None else 1)
+
+    def _op(self, op):
+        fut = asyncio.get_running_loop().create_future()
+        self._ops.append(lambda: fut.set_result(op()))
+        return fut
+
+    def expire(self, key, secs):
+        self._ops.append(lambda: self._redis.expires.__setitem__(key, secs))
+
+    async def execute(self):
+        for op in self._ops:
+            op()
+
+class FakeRedis(object):
+    """
+    模拟工作队列用到的redis命令，lua脚本按脚本对象以python实现相同语义
+    """
+
+    def __init__(self):
+        self.lists = defaultdict(list)  # 下标0为表头
+        self.zsets = defaultdict(dict)
+        self.hashes = defaultdict(dict)
+        self.expires = {}
+        self.fail_evals = 0
+        self.duplicate_results = False
+
+    def _lpush(self, key, *values):
+        for value in values:
+            self.lists[key].insert(0, value)
+
+    def _rpush(self, key, *values):
+        if self.duplicate_results:
+            values = [v for value in values for v in (value, value)]
+        self.lists[key].extend(values)
+
+    async def lpush(self, key, *values):
+        self._lpush(key, *values)
+
+    async def rpush(self, key, *values):
+        self._rpush(key, *values)
+
+    async def blpop(self, key, timeout=0):
+        await asyncio.sleep(0.001)
+        if self.lists[key]:
+            return [key, self.lists[key].pop(0)]
+        return None
+
+    async def delete(self, key):
+        self.lists.pop(key, None)
+        self.expires.pop(key, None)
+
+    def multi_exec(self):
+        return FakeTransaction(self)
+
+    async def execute(self, command, script, numkeys, *keys_and_args, encoding=None):
+        assert command == b'EVAL'
+        return await self.eval(script, keys=list(keys_and_args[:numkeys]), args=list(keys_and_args[numkeys:]))
+
+    async def eval(self, script, keys=[], args=[]):
+        if self.fail_evals:
+            self.fail_evals -= 1
+            raise ConnectionError('redis down')
+        if script is dc._LEASE_SCRIPT:
+            unit = self.lists[keys[0]].pop() if self.lists[keys[0]] else None
+            if unit is not None:
+                self.zsets[keys[1]][unit] = args[0]
+            return unit
+        if script is dc._REAP_SCRIPT:
+            expired = [unit for unit, score in self.zsets[keys[0]].items() if score <= args[0]]
+            attempts = self.hashes[keys[3]]
+            for unit in expired:
+                del self.zsets[keys[0]][unit]
+                attempts[unit] = attempts.get(unit, 0) + 1
+                if attempts[unit] >= args[1]:
+                    del attempts[unit]
+                    self._lpush(keys[2], unit)
+                else:
+                    self._lpush(keys[1], unit)
+            return len(expired)
+        if script is dc._PENDING_SCRIPT:
+            return [len(self.lists[keys[0]]), len(self.zsets[keys[1]]), len(self.lists[keys[2]])]
+        raise AssertionError('unexpected script')
+
+class FakeSite(object):
+    """
+    模拟新浪滚动新闻：pages为各频道的页数，fail_lids中的频道列表页抓取失败
+    """
+
+    def __init__(self, pages, fail_lids=()):
+        self.pages = pages
+        self.fail_lids = fail_lids
+        self.fetched = []
+        self.saved = []
+
+    def install(self, monkeypatch):
+        monkeypatch.setattr(ac, 'roll_page_url', lambda lid, page: (lid, page))
+        monkeypatch.setattr(ac, 'fetch_roll_page', self.fetch_roll_page)
+        monkeypatch.setattr(ac, 'parse_roll_items', self.parse_roll_items)
+        monkeypatch.setattr(ac, 'fetch_news_item_body', self.fetch_news_item_body)
+        monkeypatch.setattr(ac, 'save_news_item', self.save_news_item)
+
+    async def fetch_roll_page(self, session, url):
+        self.fetched.append(url)
+        lid, page = url
+        if lid in self.fail_lids:
+            raise RuntimeError('fetch failed')
+        return url
+
+    def parse_roll_items(self, timeline, json_response):
+        lid, page = json_response
+        items = [SinaRollNewsItem(f'{lid}-{page}-{i}', lids=[lid], timestamp='1577836800') for i in range(2)]
+        return items, page < self.pages[lid]
+
+    async def fetch_news_item_body(self, session, summary_cache, news_item):
+        return True
+
+    async def save_news_item(self, redis, news_item):
+        self.saved.append(news_item.oid)
+
+@pytest.fixture(autouse=True)
+def fast_polls(monkeypatch):
+    monkeypatch.setattr(ct, 'WORK_POLL_SECS', 0.01)
+    monkeypatch.setattr(dc.logger, 'handlers', [])
+    monkeypatch.setattr(ac.logger, 'handlers', [])
+
+    async def maintain(redis, ts_expire):
+        pass
+    monkeypatch.setattr(ac, 'maintain', maintain)
+
+def _work(redis, max_idle_secs=0):
+    return dc._work(redis, None, SummaryCache(redis), {'lookups': 0}, max_idle_secs)
+
+def _units(redis, key):
+    return [dc._unpack_unit(unit) for unit in redis.lists[key]]
+
+def _results(redis, key):
+    return [json.loads(result) for result in redis.lists[key]]
+
+def test_work_leases_handles_and_acks_page_unit(monkeypatch):
+    site = FakeSite({'100': 2})
+    site.install(monkeypatch)
+    redis = FakeRedis()
+    redis._lpush(ct.KEY_WORK_QUEUE, dc._page_unit('run1', '100', 1, 0))
+
+    asyncio.run(_work(redis))
+
+    results_key = ct.KEY_WORK_RESULTS.format(run='run1')
+    assert _results(redis, results_key) == [{'run': 'run1', 'lid': '100', 'page': 1, 'next_page': True}]
+    assert redis.expires[results_key] == ct.WORK_RESULTS_EXPIRE_SECS
+    assert not redis.zsets[ct.KEY_WORK_LEASES]
+    # 列表页生成的news工作单元已在同一worker中处理完毕
+    assert sorted(site.saved) == ['100-1-0', '100-1-1']
+    assert not redis.lists[ct.KEY_WORK_QUEUE]
+
+def test_work_leaves_failed_unit_leased():
+    redis = FakeRedis()
+    redis._lpush(ct.KEY_WORK_QUEUE, msgpack.packb({'id': 'u1', 'type': 'page'}))
+
+    asyncio.run(_work(redis))
+
+    assert len(redis.zsets[ct.KEY_WORK_LEASES]) == 1
+    assert not redis.lists[ct.KEY_WORK_QUEUE]
+
+def test_work_keeps_running_after_lease_error(monkeypatch):
+    site = FakeSite({'100': 1})
+    site.install(monkeypatch)
+    redis = FakeRedis()
+    redis.fail_evals = 1
+    redis._lpush(ct.KEY_WORK_QUEUE, dc._page_unit('run1', '100', 1, 0))
+
+    asyncio.run(_work(redis))
+
+    assert site.fetched == [('100', 1)]
+    assert not redis.zsets[ct.KEY_WORK_LEASES]
+
+def test_reap_requeues_expired_leases_and_moves_exhausted_to_dead():
+    redis = FakeRedis()
+    leases = redis.zsets[ct.KEY_WORK_LEASES]
+    retry, dead, leased = (msgpack.packb({'id': unit_id}) for unit_id in ('retry', 'dead', 'leased'))
+    leases.update({retry: 0, dead: 0, leased: 2 ** 40})
+    redis.hashes[ct.KEY_WORK_ATTEMPTS][dead] = ct.WORK_MAX_ATTEMPTS - 1
+
+    assert asyncio.run(dc._reap(redis)) == 2
+
+    assert redis.lists[ct.KEY_WORK_QUEUE] == [retry]
+    assert redis.lists[ct.KEY_WORK_DEAD] == [dead]
+    assert redis.hashes[ct.KEY_WORK_ATTEMPTS] == {retry: 1}
+    assert list(leases) == [leased]
+
+def test_idle_worker_reaps_until_unit_is_dead(monkeypatch):
+    site = FakeSite({'100': 1}, fail_lids=('100',))
+    site.install(monkeypatch)
+    monkeypatch.setattr(ct, 'WORK_LEASE_SECS', -1)
+    redis = FakeRedis()
+    redis._lpush(ct.KEY_WORK_QUEUE, dc._page_unit('run1', '100', 1, 0))
+
+    asyncio.run(_work(redis, max_idle_secs=0.05))
+
+    assert len(site.fetched) == ct.WORK_MAX_ATTEMPTS
+    assert [u['lid'] for u in _units(redis, ct.KEY_WORK_DEAD)] == ['100']
+    assert not redis.hashes[ct.KEY_WORK_ATTEMPTS]
+    assert not redis.lists[ct.KEY_WORK_QUEUE]
+    assert not redis.zsets[ct.KEY_WORK_LEASES]
+
+async def _run_round(redis):
+    await asyncio.wait_for(asyncio.gather(dc.run_coordinator(redis), _work(redis, max_idle_secs=0.2)), 10)
+
+def test_coordinator_paginates_until_last_page(monkeypatch):
+    monkeypatch.setattr(ct, 'GLOBAL_CHANNELS', {'100': '全部', '101': '国内'})
+    site = FakeSite({'100': 3, '101': 1})
+    site.install(monkeypatch)
+    redis = FakeRedis()
+
+    asyncio.run(_run_round(redis))
+
+    assert sorted(site.fetched) == [('100', 1), ('100', 2), ('100', 3), ('101', 1)]
+    assert len(site.saved) == 8
+    assert not [key for key, units in redis.lists.items() if units]
+    assert not redis.zsets[ct.KEY_WORK_LEASES]
+
+def test_coordinator_skips_duplicate_page_results(monkeypatch):
+    monkeypatch.setattr(ct, 'GLOBAL_CHANNELS', {'100': '全部'})
+    site = FakeSite({'100': 2})
+    site.install(monkeypatch)
+    redis = FakeRedis()
+    # 模拟租约到期后同一page工作单元被处理两次
+    redis.duplicate_results = True
+
+    asyncio.run(_run_round(redis))
+
+    assert site.fetched == [('100', 1), ('100', 2)]
+
+def test_coordinator_stops_when_channel_page_is_dead(monkeypatch, caplog):
+    monkeypatch.setattr(ct, 'GLOBAL_CHANNELS', {'100': '全部', '101': '国内'})
+    monkeypatch.setattr(ct, 'WORK_LEASE_SECS', -1)
+    site = FakeSite({'100': 1, '101': 1}, fail_lids=('101',))
+    site.install(monkeypatch)
+    redis = FakeRedis()
+
+    with caplog.at_level(logging.ERROR, logger='dist_crawl'):
+        asyncio.run(_run_round(redis))
+
+    assert [u['lid'] for u in _units(redis, ct.KEY_WORK_DEAD)] == ['101']
+    assert 'Channel pagination aborted, global_lid=101, page=1' in caplog.text
+    assert 'global_lid=100' not in caplog.text
+
+def test_news_unit_carries_packed_item_without_body():
+    item = SinaRollNewsItem('comos:1', url='https://sina.cn/1', lids=['100', '101'], title='标题',
+                            timestamp='1577836800', keywords=['关键字'], summary='摘要', body='正文')
+
+    unit = dc._unpack_unit(dc._news_unit('run1', item))
+    restored = dc._news_item_from_unit(unit)
+
+    assert (unit['type'], unit['run']) == ('news', 'run1')
+    assert isinstance(unit['item'], bytes)
+    assert (restored.oid, restored.lids, restored.keywords) == ('comos:1', ['100', '101'], ['关键字'])
+    assert restored.body is None and restored.summary is None
+    assert item.body == '正文'
+
+def test_ack_removes_lease_and_attempts():
+    redis = FakeRedis()
+    unit = dc._page_unit('run1', '100', 1, 0)
+    redis.zsets[ct.KEY_WORK_LEASES][unit] = 0
+    redis.hashes[ct.KEY_WORK_ATTEMPTS][unit] = 1
+
+    assert asyncio.run(dc._ack(redis, unit)) == 1
+    assert asyncio.run(dc._ack(redis, unit)) == 0
+    assert not redis.hashes[ct.KEY_WORK_ATTEMPTS]
+
+@pytest.fixture
+def lua_redis():
+    """
+    在fakeredis中执行lua脚本（依赖lupa，Lua 5.1，与redis服务端一致）
+    """
+    fakeredis = pytest.importorskip('fakeredis')
+    pytest.importorskip('lupa')
+    return fakeredis.FakeRedis()
+
+def test_lease_script_moves_oldest_unit_to_leases(lua_redis):
+    units = [dc._page_unit('run1', lid, 1, 0) for lid in ('100', '101')]
+    lua_redis.lpush(ct.KEY_WORK_QUEUE, *units)
+
+    leased = lua_redis.eval(dc._LEASE_SCRIPT, 2, ct.KEY_WORK_QUEUE, ct.KEY_WORK_LEASES, 123)
+
+    assert leased == units[0]
+    assert lua_redis.zrange(ct.KEY_WORK_LEASES, 0, -1, withscores=True) == [(units[0], 123.0)]
+    assert lua_redis.lrange(ct.KEY_WORK_QUEUE, 0, -1) == [units[1]]
+
+def test_lease_script_returns_nil_on_empty_queue(lua_redis):
+    assert lua_redis.eval(dc._LEASE_SCRIPT, 2, ct.KEY_WORK_QUEUE, ct.KEY_WORK_LEASES, 123) is None
+
+def test_reap_script_counts_attempts_without_decoding_units(lua_redis):
+    unit = dc._news_unit('run1', SinaRollNewsItem('comos:1', lids=['100'], timestamp='1577836800'))
+    keys = [ct.KEY_WORK_LEASES, ct.KEY_WORK_QUEUE, ct.KEY_WORK_DEAD, ct.KEY_WORK_ATTEMPTS]
+
+    def expire_and_reap():
+        lua_redis.zadd(ct.KEY_WORK_LEASES, {unit: 100})
+        lua_redis.zadd(ct.KEY_WORK_LEASES, {b'not-expired': 300})
+        reaped = lua_redis.eval(dc._REAP_SCRIPT, 4, *keys, 200, ct.WORK_MAX_ATTEMPTS)
+        queue = lua_redis.lrange(ct.KEY_WORK_QUEUE, 0, -1)
+        lua_redis.delete(ct.KEY_WORK_QUEUE)
+        return reaped, queue
+
+    for attempts in range(1, ct.WORK_MAX_ATTEMPTS):
+        assert expire_and_reap() == (1, [unit])
+        assert lua_redis.hget(ct.KEY_WORK_ATTEMPTS, unit) == str(attempts).encode()
+        assert not lua_redis.lrange(ct.KEY_WORK_DEAD, 0, -1)
+
+    assert expire_and_reap() == (1, [])
+    assert lua_redis.lrange(ct.KEY_WORK_DEAD, 0, -1) == [unit]
+    assert not lua_redis.hexists(ct.KEY_WORK_ATTEMPTS, unit)
+    assert lua_redis.zrange(ct.KEY_WORK_LEASES, 0, -1) == [b'not-expired']
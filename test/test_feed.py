@@ -0,0 +1,320 @@
+import asyncio
+import json
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip('aioredis')
+pytest.importorskip('pandas')
+etree = pytest.importorskip('lxml.etree')
+
+from rtnews import cons as ct
+from rtnews.feed import async_newsevent as ne
+from rtnews.feed import feed_vars as fv
+from rtnews.feed.news_cache import NewsCache
+
+ATOM = '{http://www.w3.org/2005/Atom}'
+LID = '107'
+
+def _rows(n=2):
+    return [{'title': f'标题{i}', 'summary': f'摘要{i}', 'time': '2020-01-01 08:00:00',
+             'url': f'https://tech.sina.com.cn/{i}.shtml', 'timestamp': 1577836800 + i} for i in range(n)]
+
+@pytest.fixture(autouse=True)
+def dat_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(ct, 'DAT_DIR', str(tmp_path))
+    # logger在导入时已绑定dat/feed.log，测试中不写入仓库目录
+    monkeypatch.setattr(ne.logger, 'handlers', [])
+    return tmp_path
+
+@pytest.fixture(autouse=True)
+def news_cache(monkeypatch):
+    cache = NewsCache(fv.NEWS_CACHE_SIZE)
+    monkeypatch.setattr(ne, 'news_cache', cache)
+    return cache
+
+def test_default_feed_formats_is_html_only():
+    assert fv.FEED_FORMATS == ['html']
+
+def test_render_atom_has_feed_author_and_entries(dat_dir):
+    ne.RENDERERS['atom'](LID, _rows())
+
+    feed = etree.parse(str(dat_dir / '科技.atom.xml')).getroot()
+    assert feed.findtext(f'{ATOM}author/{ATOM}name') == fv.FEED_AUTHOR
+    assert [e.findtext(f'{ATOM}title') for e in feed.findall(f'{ATOM}entry')] == ['标题0', '标题1']
+    assert feed.findtext(f'{ATOM}updated') == ne._isoformat(1577836801)
+
+def test_render_rss_items(dat_dir):
+    ne.RENDERERS['rss'](LID, _rows())
+
+    channel = etree.parse(str(dat_dir / '科技.rss.xml')).getroot().find('channel')
+    assert [item.findtext('link') for item in channel.findall('item')] == [
+        'https://tech.sina.com.cn/0.shtml', 'https://tech.sina.com.cn/1.shtml']
+
+def test_render_json_feed(dat_dir):
+    ne.RENDERERS['json'](LID, _rows(1))
+
+    feed = json.loads((dat_dir / '科技.json').read_text(encoding='utf-8'))
+    assert feed['title'] == '科技实时新闻摘要'
+    assert feed['items'][0]['id'] == 'https://tech.sina.com.cn/0.shtml'
+    assert feed['items'][0]['summary'] == '摘要0'
+
+def test_render_txt_and_html(dat_dir):
+    ne.RENDERERS['txt'](LID, _rows())
+    ne.RENDERERS['html'](LID, _rows())
+
+    assert (dat_dir / '科技.txt').read_text(encoding='utf-8').count('---\n') == 2
+    assert '标题1' in (dat_dir / '科技.html').read_text(encoding='utf-8')
+
+def _now():
+    return int(datetime.now().timestamp())
+
+def test_news_cache_hits_and_misses():
+    cache = NewsCache(4)
+    cache.put('news-1', {'title': '标题1', 'timestamp': _now()})
+
+    assert list(cache.get_many(['news-1', 'news-2'])) == ['news-1']
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_news_cache_evicts_expired_entries():
+    cache = NewsCache(4)
+    cache.put('news-1', {'title': '标题1', 'timestamp': _now() - ct.NEWS_EXPIRE_SECS - 1})
+
+    assert cache.get_many(['news-1']) == {}
+    assert len(cache) == 0
+
+def test_news_cache_evicts_least_recently_used():
+    cache = NewsCache(2)
+    for i in range(2):
+        cache.put(f'news-{i}', {'timestamp': _now()})
+    cache.get_many(['news-0'])
+    cache.put('news-2', {'timestamp': _now()})
+
+    assert sorted(cache.get_many(['news-0', 'news-1', 'news-2'])) == ['news-0', 'news-2']
+
+def test_news_cache_invalidate():
+    cache = NewsCache(4)
+    cache.put('news-1', {'timestamp': _now()})
+    cache.invalidate('news-1')
+    cache.invalidate('news-2')
+
+    assert cache.get_many(['news-1']) == {}
+
+class FakeChannel(object):
+    def __init__(self):
+        self.messages = asyncio.Queue()
+
+    async def iter(self, encoding=None):
+        while True:
+            yield await self.messages.get()
+
+class FakePubSub(object):
+    def __init__(self):
+        self.closed = False
+        self.channels = {}
+
+    async def subscribe(self, name):
+        self.channels[name] = FakeChannel()
+        return [self.channels[name]]
+
+    async def unsubscribe(self, name):
+        del self.channels[name]
+
+    async def publish(self, name, message):
+        if name in self.channels:
+            await self.channels[name].messages.put(message)
+
+def test_news_cache_listen_evicts_published_keys():
+    cache = NewsCache(4)
+    redis = FakePubSub()
+
+    async def run():
+        for i in range(2):
+            cache.put(f'news-{i}', {'timestamp': _now()})
+        task = asyncio.create_task(cache.listen(redis))
+        while ct.CHANNEL_NEWS_INVALIDATE not in redis.channels:
+            await asyncio.sleep(0)
+        await redis.publish(ct.CHANNEL_NEWS_INVALIDATE, 'news-0')
+        while len(cache) == 2:
+            await asyncio.sleep(0)
+        assert list(cache.get_many(['news-0', 'news-1'])) == ['news-1']
+
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+    # 停止订阅后清空缓存并退订
+    assert len(cache) == 0
+    assert not redis.channels
+
+class FakePipeline(object):
+    ZSET_EXCLUDE_MIN = 'ZSET_EXCLUDE_MIN'
+
+    def __init__(self, redis):
+        self._redis = redis
+        self._calls = []
+
+    def _call(self, result):
+        fut = asyncio.get_running_loop().create_future()
+        self._calls.append((fut, result))
+        return fut
+
+    def zrevrangebyscore(self, *args, **kwargs):
+        return self._call(self._redis._zrevrangebyscore(*args, **kwargs))
+
+    def hmget(self, key, *fields):
+        return self._call(self._redis._hmget(key, *fields))
+
+    def hget(self, key, field):
+        return self._call(self._redis._hget(key, field))
+
+    async def execute(self):
+        for fut, result in self._calls:
+            fut.set_result(result)
+
+class FakeRedis(object):
+    """
+    新闻hash及频道zset，zset默认为LID频道包含全部新闻、分数为新闻时间戳；commands记录读取过的key
+    """
+
+    ZSET_EXCLUDE_MIN = 'ZSET_EXCLUDE_MIN'
+
+    def __init__(self, data, zsets=None):
+        self.data = data
+        if zsets is None:
+            zsets = {ct.KEY_LID.format(lid=LID): {key: int(news['timestamp']) for key, news in data.items()}}
+        self.zsets = zsets
+        self.commands = []
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    def _zrevrangebyscore(self, key, max=float('inf'), min=float('-inf'), *, exclude=None, offset=None, count=None):
+        self.commands.append(('zrevrangebyscore', key))
+        zset = self.zsets.get(key, {})
+        above_min = (lambda score: score > min) if exclude == self.ZSET_EXCLUDE_MIN else (lambda score: score >= min)
+        members = sorted([m for m, score in zset.items() if score <= max and above_min(score)], key=lambda m: -zset[m])
+        if offset is not None:
+            members = members[offset:offset + count]
+        return members
+
+    def _hmget(self, key, *fields):
+        self.commands.append(('hmget', key))
+        news = self.data.get(key, {})
+        return [news.get(field) for field in fields]
+
+    def _hget(self, key, field):
+        self.commands.append(('hget', key))
+        return self.data.get(key, {}).get(field)
+
+    async def zrevrangebyscore(self, *args, **kwargs):
+        return self._zrevrangebyscore(*args, **kwargs)
+
+def _hmgets(redis):
+    return [key for command, key in redis.commands if command == 'hmget']
+
+def _news(i, timestamp):
+    return {'oid': str(i), 'title': f'标题{i}', 'summary': f'摘要{i}', 'url': f'https://sina.cn/{i}',
+            'timestamp': str(timestamp), 'body': f'正文{i}'}
+
+def _redis_news():
+    ts = _now()
+    return {f'news-{i}': _news(i, ts - i) for i in range(2)}
+
+def test_read_news_caches_metadata_without_body():
+    redis = FakeRedis(_redis_news())
+
+    rows = asyncio.run(ne._read_news(redis, ['news-0', 'news-1', 'news-0', 'news-9']))
+
+    assert sorted(rows) == ['news-0', 'news-1']
+    assert 'body' not in rows['news-0']
+    assert rows['news-1']['summary'] == '摘要1'
+    assert _hmgets(redis) == ['news-0', 'news-1', 'news-9']
+
+def test_read_news_reads_each_key_once_across_calls():
+    redis = FakeRedis(_redis_news())
+    asyncio.run(ne._read_news(redis, ['news-0']))
+
+    rows = asyncio.run(ne._read_news(redis, ['news-0', 'news-1']))
+
+    assert sorted(rows) == ['news-0', 'news-1']
+    assert _hmgets(redis) == ['news-0', 'news-1']
+
+def test_read_bodies():
+    redis = FakeRedis(_redis_news())
+
+    assert asyncio.run(ne._read_bodies(redis, ['news-1', 'news-9'])) == {'news-1': '正文1', 'news-9': None}
+
+def test_get_latest_news_reads_body_only_when_requested():
+    redis = FakeRedis(_redis_news())
+
+    df = asyncio.run(ne.get_latest_news(redis, '科技'))
+    assert list(df.columns) == fv.LATEST_COLS
+    assert ('hget', 'news-0') not in redis.commands
+
+    df = asyncio.run(ne.get_latest_news(redis, '科技', show_Body=True))
+    assert list(df.columns) == fv.LATEST_COLS_C
+    assert df['body'].tolist() == ['正文0', '正文1']
+    assert _hmgets(redis) == ['news-0', 'news-1']
+
+def _expiry_redis():
+    # 新闻hash尚未被redis删除，但分数已不大于当前时间-NEWS_EXPIRE_SECS的key视为过期
+    ts = _now()
+    ts_expire = ts - ct.NEWS_EXPIRE_SECS
+    scores = {'news-0': ts - 10, 'news-1': ts - 100, 'news-2': ts - 101,
+              'news-edge': ts_expire, 'news-old': ts_expire - 100}
+    data = {key: _news(i, score) for i, (key, score) in enumerate(scores.items())}
+    return FakeRedis(data, {ct.KEY_LID.format(lid=LID): scores}), ts
+
+def _alive(redis, **kwargs):
+    async def run():
+        return await ne._zrevrange_alive(redis, ct.KEY_LID.format(lid=LID), **kwargs)
+    return asyncio.run(run())
+
+def test_zrevrange_alive_excludes_expired_members():
+    redis, ts = _expiry_redis()
+
+    assert _alive(redis) == ['news-0', 'news-1', 'news-2']
+
+def test_zrevrange_alive_timeline_is_inclusive():
+    redis, ts = _expiry_redis()
+
+    assert _alive(redis, timeline=ts - 100) == ['news-0', 'news-1']
+
+def test_zrevrange_alive_timeline_before_expiry_uses_expiry_bound():
+    redis, ts = _expiry_redis()
+
+    assert _alive(redis, timeline=ts - ct.NEWS_EXPIRE_SECS - 1000) == ['news-0', 'news-1', 'news-2']
+
+def test_zrevrange_alive_top():
+    redis, ts = _expiry_redis()
+
+    assert _alive(redis, top=2) == ['news-0', 'news-1']
+
+def test_get_latest_news_never_reads_expired_news():
+    redis, ts = _expiry_redis()
+
+    df = asyncio.run(ne.get_latest_news(redis, LID, show_Body=True))
+
+    assert df['title'].tolist() == ['标题0', '标题1', '标题2']
+    assert _hmgets(redis) == ['news-0', 'news-1', 'news-2']
+    assert not [key for command, key in redis.commands if key in ('news-edge', 'news-old')]
+
+def test_build_feeds_reads_each_news_once_for_all_channels_and_formats(dat_dir):
+    ts = _now()
+    data = {f'news-{i}': _news(i, ts - i) for i in range(3)}
+    # 全部频道(100)是科技频道(107)的超集
+    zsets = {ct.KEY_LID.format(lid='100'): {key: int(news['timestamp']) for key, news in data.items()},
+             ct.KEY_LID.format(lid=LID): {key: int(data[key]['timestamp']) for key in ('news-0', 'news-2')}}
+    redis = FakeRedis(data, zsets)
+    formats = list(ne.RENDERERS)
+
+    asyncio.run(ne.build_feeds(redis, ['100', LID], formats))
+
+    assert sorted(_hmgets(redis)) == ['news-0', 'news-1', 'news-2']
+    assert sorted(p.name for p in dat_dir.iterdir()) == sorted(
+        f'{ct.GLOBAL_CHANNELS[lid]}{fv.FEED_FILE_EXTS[fmt]}' for lid in ('100', LID) for fmt in formats)
+    txt = (dat_dir / '科技.txt').read_text(encoding='utf-8')
+    assert '标题0' in txt and '标题2' in txt and '标题1' not in txt
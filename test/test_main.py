@@ -0,0 +1,56 @@
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+from rtnews import cons as ct
+
+# 启动及--help不应导入的重量级依赖，这些模块只在对应阶段运行时才导入
+HEAVY_MODULES = ('pandas', 'numpy', 'lxml', 'aiohttp', 'aioredis', 'textrank4zh', 'jieba', 'pyarrow', 'msgpack')
+
+@pytest.fixture
+def work_dir(tmp_path):
+    """
+    将rtnews包复制到临时目录运行，DAT_DIR随包的位置确定，不受仓库中已有dat目录的影响
+    """
+    src = os.path.dirname(os.path.abspath(ct.__file__))
+    shutil.copytree(src, str(tmp_path / 'rtnews'), ignore=shutil.ignore_patterns('__pycache__'))
+    return tmp_path
+
+def _run(work_dir, *args):
+    env = dict(os.environ, PYTHONPATH=str(work_dir))
+    return subprocess.run([sys.executable, *args], cwd=str(work_dir), env=env,
+                          capture_output=True, text=True, check=True)
+
+def _imported_modules(importtime_output):
+    modules = set()
+    for line in importtime_output.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            modules.add(line.rsplit('|', 1)[1].strip())
+    return modules
+
+def test_help_does_not_import_stage_dependencies(work_dir):
+    proc = _run(work_dir, '-X', 'importtime', '-m', 'rtnews', '--help')
+
+    modules = _imported_modules(proc.stderr)
+    assert 'rtnews.cons' in modules
+    assert not [m for m in modules if m.split('.')[0] in HEAVY_MODULES]
+    assert 'crawl' in proc.stdout
+
+def test_help_does_not_create_dat_dir(work_dir):
+    _run(work_dir, '-m', 'rtnews', '--help')
+    _run(work_dir, '-m', 'rtnews', 'worker', '--help')
+
+    assert not (work_dir / 'dat').exists()
+
+def test_import_cons_does_not_create_dat_dir(work_dir):
+    _run(work_dir, '-c', 'from rtnews import cons as ct; ct.get_logger("test", ct.LOG_LEVEL, ct.MAIN_LOG_FILE)')
+
+    assert not (work_dir / 'dat').exists()
+
+def test_log_file_is_created_on_first_record(work_dir):
+    _run(work_dir, '-c', 'from rtnews import cons as ct; ct.get_logger("test", ct.LOG_LEVEL, ct.MAIN_LOG_FILE).info("hi")')
+
+    assert 'hi' in (work_dir / 'dat' / 'rtnews.log').read_text(encoding='utf-8')